@@ -10,11 +10,16 @@ import json
 from dataclasses import dataclass
 import re
 import array
+import bisect
 import itertools
 import lzma
+import zlib
+import mmap
 import hashlib
-import threading
+import concurrent.futures
 import math
+import copy
+import collections.abc
 from typing import Callable
 
 try:
@@ -22,9 +27,30 @@ try:
 except ModuleNotFoundError:
     Image = None
 
+try:
+    import numpy
+except ModuleNotFoundError:
+    numpy = None
+
+try:
+    import sqlite3
+except ModuleNotFoundError:
+    sqlite3 = None
+
+try:
+    import xxhash
+except ModuleNotFoundError:
+    xxhash = None
+
 THUMB_WIDTH = 64
 fallback_encoding = 'cp1251' # Russian addons are probably most common.
 
+# remembers GMA headers between runs, in the current directory like the hash caches
+GMA_INDEX_PATH = "gmaindex.sqlite3"
+# rendered thumbnails, oldest used get thrown out past the size limit
+THUMB_CACHE_PATH = "thumbcache.sqlite3"
+THUMB_CACHE_SIZE = 16*1024*1024
+
 # relative to home
 DEFAULT_STEAM_PATH = pathlib.PurePath(".local", "share", "Steam")
 
@@ -33,6 +59,9 @@ STEAM_WORKSHOP_PATH = pathlib.PurePath("steamapps", "workshop", "content", str(G
 
 STEAM_APP_PATH = pathlib.PurePath("steamapps", "common")
 
+# lists other steam library folders, which can also have games and addons
+LIBRARY_FOLDERS_PATH = pathlib.PurePath("steamapps", "libraryfolders.vdf")
+
 GARRYSMOD_PATH = pathlib.PurePath(STEAM_APP_PATH, "GarrysMod")
 
 DEPOTS_PATH = pathlib.PurePath("garrysmod", "cfg", "mountdepots.txt")
@@ -74,25 +103,83 @@ SIZE_UNITS = ('b', 'KiB', 'MiB', 'GiB', 'TiB', 'PiB')
 # 1MB seems good
 READ_SIZE = 1024*1024
 
+# VPK archive files kept open at once while reading from a VPK set
+VPK_OPEN_ARCHIVES = 8
+# neighboring VPK entries are read together in runs up to this big, skipping
+# over gaps up to this big between them instead of seeking
+VPK_RUN_SIZE = 8*1024*1024
+VPK_RUN_GAP = 16*1024
+
+# for splitting up hashing work between workers
+MIN_TASK_SIZE = 16*1024*1024
+TASKS_PER_WORKER = 4
+# seconds between progress lines while hashing
+PROGRESS_INTERVAL = 5
+
+# threads for reading GMA headers when listing, it's mostly waiting on the disk
+LIST_WORKERS = 8
+# addons extracted at once, more than a few just fight over the disk
+DUMP_WORKERS = 4
+# written in each dumped addon's directory so --sync knows what's already there
+DUMP_MANIFEST_NAME = ".gmadump.json"
+DUMP_MANIFEST_VERSION = 1
+
 CHARS4 = array.array('w', ' 𜺨𜴀▘𜴉𜴊🯦𜴍𜺣𜴶𜴹𜴺▖𜵅𜵈▌𜺫🮂𜴁𜴂𜴋𜴌𜴎𜴏𜴷𜴸𜴻𜴼𜵆𜵇𜵉𜵊𜴃𜴄𜴆𜴇𜴐𜴑𜴔𜴕𜴽𜴾𜵁𜵂𜵋𜵌𜵎𜵏▝𜴅𜴈▀𜴒𜴓𜴖𜴗𜴿𜵀𜵃𜵄▞𜵍𜵐▛'
                           '𜴘𜴙𜴜𜴝𜴧𜴨𜴫𜴬𜵑𜵒𜵕𜵖𜵡𜵢𜵥𜵦𜴚𜴛𜴞𜴟𜴩𜴪𜴭𜴮𜵓𜵔𜵗𜵘𜵣𜵤𜵧𜵨🯧𜴠𜴣𜴤𜴯𜴰𜴳𜴴𜵙𜵚𜵝𜵞𜵩𜵪𜵭𜵮𜴡𜴢𜴥𜴦𜴱𜴲𜴵🮅𜵛𜵜𜵟𜵠𜵫𜵬𜵯𜵰'
                           '𜺠𜵱𜵴𜵵𜶀𜶁𜶄𜶅▂𜶬𜶯𜶰𜶻𜶼𜶿𜷀𜵲𜵳𜵶𜵷𜶂𜶃𜶆𜶇𜶭𜶮𜶱𜶲𜶽𜶾𜷁𜷂𜵸𜵹𜵼𜵽𜶈𜶉𜶌𜶍𜶳𜶴𜶷𜶸𜷃𜷄𜷇𜷈𜵺𜵻𜵾𜵿𜶊𜶋𜶎𜶏𜶵𜶶𜶹𜶺𜷅𜷆𜷉𜷊'
                           '▗𜶐𜶓▚𜶜𜶝𜶠𜶡𜷋𜷌𜷏𜷐▄𜷛𜷞▙𜶑𜶒𜶔𜶕𜶞𜶟𜶢𜶣𜷍𜷎𜷑𜷒𜷜𜷝𜷟𜷠𜶖𜶗𜶙𜶚𜶤𜶥𜶨𜶩𜷓𜷔𜷗𜷘𜷡𜷢▆𜷤▐𜶘𜶛▜𜶦𜶧𜶪𜶫𜷕𜷖𜷙𜷚▟𜷣𜷥█')
 
+# which bit of the CHARS4 index each pixel of a 2x4 cell is, left to right
+# then top to bottom
+OCTANT_BITS = (1, 16, 2, 32, 4, 64, 8, 128)
+
+# threads are fine when most of the time is spent waiting on the disk, processes
+# get around the GIL when it's spent in python
+EXECUTORS = {
+    "thread": concurrent.futures.ThreadPoolExecutor,
+    "process": concurrent.futures.ProcessPoolExecutor
+}
+
 PATHSLASH = '\\' if isinstance(pathlib.Path(), pathlib.WindowsPath) else '/'
 
-@dataclass
-class FileHash():
-    size : int
-    digest : bytes
+class FileHash(bytes):
+    # file size and digest packed together, so comparing two is one bytes
+    # comparison and there's no object dict for every file.  Laid out the same
+    # as the end of a hash cache record so those can be used as they are.
+    __slots__ = ()
+
+    SIZE = struct.Struct("<Q")
+
+    def __new__(cls, size : int, digest : bytes):
+        return super().__new__(cls, FileHash.SIZE.pack(size) + digest)
+
+    def from_packed(packed : bytes) -> FileHash:
+        return bytes.__new__(FileHash, packed)
 
-    def __eq__(self, other):
-        return self.size == other.size and self.digest == other.digest
+    def get_size(self) -> int:
+        return FileHash.SIZE.unpack_from(self)[0]
+
+    def get_digest(self) -> bytes:
+        return bytes(self[FileHash.SIZE.size:])
+
+    def __reduce__(self):
+        # the default would pass the packed bytes to __new__
+        return (FileHash.from_packed, (bytes(self),))
 
 type FileList_T = dict[str, FileHash]
 type DepotFileList_T = dict[str, FileList_T]
+# something that changes when what was hashed changes: time, size, stamp
+type CacheKey_T = tuple[float, int, int]
 
-SHA1_T = type(hashlib.sha1())
+# collisions just need to tell files apart, nothing here needs to be secure
+HASH_ALGORITHMS = {
+    "sha1": lambda: hashlib.sha1(usedforsecurity=False),
+    "blake2b": lambda: hashlib.blake2b(digest_size=16)
+}
+if xxhash is not None:
+    HASH_ALGORITHMS["xxh3"] = xxhash.xxh3_128
+DEFAULT_HASH = "blake2b" if xxhash is None else "xxh3"
+hash_algorithm = DEFAULT_HASH
 
 def log_print(string : str = '', end : str = '\n'):
     sys.stderr.write(string)
@@ -133,6 +220,9 @@ def fix_slashes(filename : str) -> str:
 class ValveFile:
     # stuff for avoiding seeking for the LZMA decompressor
     READ_BUFFER_SIZE = 32768
+    # uncompressed files are mapped in to memory instead so reads don't have to
+    # be copied through the buffer
+    USE_MMAP = True
 
     def consume_buffer(self, count : int, dispose : bool = False) -> bytes:
         count = min(count, self.filled)
@@ -151,6 +241,11 @@ class ValveFile:
         return b''
  
     def read(self, count : int) -> bytes:
+        if self.map is not None:
+            retbuf = self.map[self.mappos:self.mappos+count]
+            self.mappos += len(retbuf)
+            return retbuf
+
         if self.file is None:
             return b''
 
@@ -164,7 +259,33 @@ class ValveFile:
 
         return retbuf
 
+    def read_view(self, count : int) -> bytes | memoryview:
+        # like read() but if the file is mapped, avoid the copy.  The data is
+        # only good until the file is closed.
+        if self.map is not None:
+            retbuf = self.view[self.mappos:self.mappos+count]
+            self.mappos += len(retbuf)
+            return retbuf
+
+        return self.read(count)
+
+    def read_struct(self, fmt : struct.Struct) -> tuple:
+        if self.map is not None:
+            ret = fmt.unpack_from(self.map, self.mappos)
+            self.mappos += fmt.size
+            return ret
+
+        return fmt.unpack(self.read(fmt.size))
+
     def read_string(self) -> str:
+        if self.map is not None:
+            null = self.map.find(b'\0', self.mappos)
+            if null < 0:
+                null = len(self.map)
+            retbuf = self.map[self.mappos:null]
+            self.mappos = null + 1
+            return decode_string(retbuf)
+
         if self.file is None:
             return ''
 
@@ -192,7 +313,7 @@ class ValveFile:
             # refill the buffer
             buf = self.file.read(len(self.buffer))
             if len(buf) == 0:
-                return retbuf
+                break
 
             self.buffer[:len(buf)] = array.array('B', buf)
             self.filled = len(buf)
@@ -200,12 +321,24 @@ class ValveFile:
         return decode_string(retbuf)
 
     def tell(self) -> int:
+        if self.map is not None:
+            return self.mappos
+
         if self.file is None:
             return 0
 
         return self.file.tell() - self.filled
 
     def seek(self, target, whence=0) -> int:
+        if self.map is not None:
+            if whence == os.SEEK_CUR:
+                self.mappos += target
+            elif whence == os.SEEK_END:
+                self.mappos = len(self.map) + target
+            else:
+                self.mappos = target
+            return self.mappos
+
         if whence == os.SEEK_CUR:
             if target < 0:
                 # if seeking backwards, dump buffer
@@ -232,7 +365,20 @@ class ValveFile:
         return self.tell()
 
     def close(self):
-        if self.file is not None:
+        if self.map is not None:
+            self.lastpos = self.mappos
+            self.view.release()
+            self.view = None
+            try:
+                self.map.close()
+            except BufferError:
+                # something still holds some data from it, it'll go away once
+                # that's let go of
+                pass
+            self.map = None
+            self.file.close()
+            self.file = None
+        elif self.file is not None:
             self.lastpos = self.file.tell()
             self.file.close()
             self.file = None
@@ -242,35 +388,233 @@ class ValveFile:
             self.file = lzma.LZMAFile(self.path)
         else:
             self.file = self.path.open('rb')
+            if self.USE_MMAP:
+                try:
+                    self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+                    self.view = memoryview(self.map)
+                    self.mappos = 0
+                except (ValueError, OSError):
+                    # empty files can't be mapped, just fall back to reading
+                    pass
+
+        # only needed if not mapped
+        if self.map is None and self.buffer is None:
+            self.buffer = array.array('B', itertools.repeat(0, self.READ_BUFFER_SIZE))
+
+    def ensure_open(self):
+        # open it again if it was closed, starting from the beginning
+        if self.file is None:
+            self.do_open()
+            self.filled = 0
 
     def reopen(self):
         self.do_open()
-        self.file.seek(self.lastpos)
+        if self.map is not None:
+            self.mappos = self.lastpos
+        else:
+            self.file.seek(self.lastpos)
 
     def stat(self):
         return os.stat(self.file.fileno())
 
+    def will_need(self, offset : int, count : int):
+        # hint that a range is about to be read so the kernel can read it in
+        # one go instead of faulting in a page at a time.  Only matters for
+        # mapped files.
+        if self.map is None or not hasattr(mmap, 'MADV_WILLNEED'):
+            return
+        start = offset - offset % mmap.PAGESIZE
+        end = min(offset + count, len(self.map))
+        if end > start:
+            self.map.madvise(mmap.MADV_WILLNEED, start, end - start)
+
+    def clone(self):
+        # get a closed copy with its own file handle and buffer, so more than
+        # one thread can read from the same file at a time
+        return copy.copy(self)
+
+    def copy_data(self, count : int, state) -> int:
+        # pass count bytes from the current position to the state's data callback
+        remaining = count
+        while remaining > 0:
+            data = self.read_view(min(remaining, READ_SIZE))
+            if len(data) == 0:
+                # truncated file
+                break
+            state.data_cb(data)
+            remaining -= len(data)
+
+        return count - remaining
+
+    def __getstate__(self):
+        # open files and the read buffer can't be sent to another process, the
+        # other side will just reopen it
+        state = self.__dict__.copy()
+        # the buffer is dropped, so pick up from the first byte that was in it
+        if self.file is None:
+            state['lastpos'] = self.lastpos - self.filled
+        else:
+            state['lastpos'] = self.tell()
+        state['file'] = None
+        state['map'] = None
+        state['view'] = None
+        state['buffer'] = None
+        state['filled'] = 0
+        return state
+
     def __enter__(self):
         return self
 
     def __exit__(self, exc_type, exc_value, exc_tb):
-        if self.file is not None:
-            self.file.close()
+        self.close()
         return False
 
-    def __init__(self, path : pathlib.PurePath, compressed : bool=False):
+    def set_stat(self, stat : os.stat_result):
+        self.size = stat.st_size
+        self.filetime = stat.st_ctime
+        self.mtime = stat.st_mtime
+
+    def init_closed(self, path : pathlib.PurePath, compressed : bool):
         self.path = pathlib.Path(path)
         self.compressed = compressed
+        self.file = None
+        self.map = None
+        self.view = None
+        self.mappos = 0
+        self.buffer = None
+        self.filled = 0
+        self.lastpos = 0
+
+    def __init__(self, path : pathlib.PurePath, compressed : bool=False):
+        self.init_closed(path, compressed)
 
         self.do_open()
 
-        stat = self.stat()
-        self.size = stat.st_size
-        self.filetime = stat.st_ctime
+        self.set_stat(self.stat())
+
+class FileTable:
+    # everything about the files in a GMA or VPK, kept in columns instead of
+    # an object per file since across all the mounted games there can be
+    # millions of them.  Names are all in one UTF-8 blob and entry objects are
+    # only made when asked for.  Looking up by name goes through a sorted
+    # array of name hashes, made the first time it's needed.  Subclasses give
+    # the COLUMNS and an entry(row) to make their entry objects.
+
+    # (name, array typecode) of each column, after the file name
+    COLUMNS : tuple[tuple[str, str], ...] = ()
+
+    # row count, then the name ends and each column as they are in memory,
+    # then the names
+    PACKED_HDR = struct.Struct("<Q")
+
+    def append(self, name : str, *values):
+        self.blob += name.encode('utf-8')
+        self.name_ends.append(len(self.blob))
+        for column, value in zip(self.columns.values(), values):
+            column.append(value)
+        self.index = None
+
+    def column(self, name : str) -> array.array:
+        return self.columns[name]
+
+    def get_packed(self) -> bytes:
+        # the whole table in one go for saving, much quicker to load back than
+        # appending every row again
+        parts = [self.PACKED_HDR.pack(len(self)), self.name_ends.tobytes()]
+        parts.extend(column.tobytes() for column in self.columns.values())
+        parts.append(self.blob)
+        return b''.join(parts)
+
+    def set_packed(self, packed : bytes):
+        view = memoryview(packed)
+        if len(view) < self.PACKED_HDR.size:
+            raise ValueError("Truncated file table.")
+        count, = self.PACKED_HDR.unpack_from(view, 0)
+        pos = self.PACKED_HDR.size
+        self.name_ends = array.array(self.name_ends.typecode)
+        self.columns = {name: array.array(typecode) for name, typecode in self.COLUMNS}
+        for column in (self.name_ends, *self.columns.values()):
+            size = count * column.itemsize
+            if pos + size > len(view):
+                raise ValueError("Truncated file table.")
+            column.frombytes(view[pos:pos+size])
+            pos += size
+        self.blob = bytearray(view[pos:])
+        if len(self.blob) != (self.name_ends[-1] if count > 0 else 0):
+            raise ValueError("File table names don't match.")
+        self.index = None
+
+    def name(self, row : int) -> str:
+        start = 0 if row == 0 else self.name_ends[row - 1]
+        return self.blob[start:self.name_ends[row]].decode('utf-8')
+
+    def names(self):
+        start = 0
+        for end in self.name_ends:
+            yield self.blob[start:end].decode('utf-8')
+            start = end
+
+    def find(self, name : str) -> int:
+        # row with this name or -1.  Cloned files share their table with other
+        # threads, so the index is only ever put in place whole.  Two threads
+        # might both build it but they'll come up with the same thing.
+        index = self.index
+        if index is None:
+            hashes = array.array('q', (hash(name) for name in self.names()))
+            rows = sorted(range(len(hashes)), key=hashes.__getitem__)
+            index = (array.array('q', (hashes[row] for row in rows)), array.array('Q', rows))
+            self.index = index
+
+        hashes, rows = index
+        namehash = hash(name)
+        pos = bisect.bisect_left(hashes, namehash)
+        while pos < len(hashes) and hashes[pos] == namehash:
+            if self.name(rows[pos]) == name:
+                return rows[pos]
+            pos += 1
+
+        return -1
+
+    def row(self, name : str) -> int:
+        row = self.find(name)
+        if row < 0:
+            raise KeyError(name)
+
+        return row
+
+    def by_name(self, name : str):
+        return self.entry(self.row(name))
+
+    def __contains__(self, name : str) -> bool:
+        return self.find(name) >= 0
+
+    def __len__(self) -> int:
+        return len(self.name_ends)
+
+    def __getitem__(self, row : int):
+        if row < 0:
+            row += len(self)
+        if row < 0 or row >= len(self):
+            raise IndexError("file table index out of range")
+
+        return self.entry(row)
 
-        self.buffer = array.array('B', itertools.repeat(0, self.READ_BUFFER_SIZE))
-        self.filled = 0
-        self.lastpos = 0
+    def __iter__(self):
+        for row in range(len(self)):
+            yield self.entry(row)
+
+    def __getstate__(self):
+        # str hashes are different in other processes so the index has to be
+        # made again over there
+        state = self.__dict__.copy()
+        state['index'] = None
+        return state
+
+    def __init__(self):
+        self.blob = bytearray()
+        self.name_ends = array.array('Q')
+        self.columns = {name: array.array(typecode) for name, typecode in self.COLUMNS}
+        self.index = None
 
 @dataclass
 class GMAEntry:
@@ -297,6 +641,78 @@ class GMAEntry:
     def __str__(self):
         return f"Name: {self.name}  Size: {human_readable_size(self.size)}"
 
+class GMAFileTable(FileTable):
+    COLUMNS = (('pos', 'q'), ('size', 'q'), ('crc', 'L'))
+
+    def entry(self, row : int) -> GMAEntry:
+        return GMAEntry(row + 1,
+                        self.name(row),
+                        self.columns['pos'][row],
+                        self.columns['size'][row],
+                        self.columns['crc'][row])
+
+class EntryReader:
+    # file-like object for reading just one entry out of a GMA or VPK.  The
+    # file is shared, so reads seek back to where they were in case something
+    # else moved it.  Subclasses just do read(count=-1).
+
+    def readall(self) -> bytes:
+        return self.read()
+
+    def tell(self) -> int:
+        return self.pos
+
+    def seek(self, target : int, whence : int = os.SEEK_SET) -> int:
+        if whence == os.SEEK_CUR:
+            target += self.pos
+        elif whence == os.SEEK_END:
+            target += self.size
+        self.pos = max(0, min(target, self.size))
+
+        return self.pos
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def close(self):
+        # the file stays open for whatever else might be reading from it
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_tb):
+        self.close()
+        return False
+
+    def __init__(self, size : int):
+        self.size = size
+        self.pos = 0
+
+class GMAEntryReader(EntryReader):
+    def read(self, count : int = -1) -> bytes:
+        remaining = self.size - self.pos
+        if count < 0 or count > remaining:
+            count = remaining
+        if count == 0:
+            return b''
+
+        target = self.gma.datapos + self.entry.pos + self.pos
+        if self.gma.tell() != target:
+            self.gma.seek(target)
+        data = self.gma.read(count)
+        self.pos += len(data)
+
+        return data
+
+    def __init__(self, gma : GMAFile, entry : GMAEntry):
+        super().__init__(entry.size)
+        self.gma = gma
+        self.entry = entry
+
 class GMAFile(ValveFile):
     # much from <https://github.com/Facepunch/gmad>
 
@@ -319,18 +735,22 @@ class GMAFile(ValveFile):
         "maps": ("Map Count", lambda x: len(x.maps))
     }
 
-    def __init__(self, path : pathlib.PurePath, compressed : bool=False):
+    def __init__(self, path : pathlib.PurePath, compressed : bool=False, keep_open : bool=False):
+        # keep_open leaves the file open at the start of the file data, so if
+        # it's going to be read right away a compressed file only needs to be
+        # decompressed once
         super().__init__(path, compressed)
 
         self.path = path
 
-        self.files = []
+        self.files = GMAFileTable()
         self.maps = {}
         self.thumbs = []
+        self.thumbs_loaded = False
 
         self.workshop_id = int(path.parent.name)
 
-        magic, version, steamid, timestamp = self.GMA_HDR.unpack(self.read(self.GMA_HDR.size))
+        magic, version, steamid, timestamp = self.read_struct(self.GMA_HDR)
         if magic != self.GMA_MAGIC:
             raise ValueError("Bad GMA file magic")
 
@@ -345,7 +765,7 @@ class GMAFile(ValveFile):
         self.name = self.read_string()
         desc = self.read_string()
         self.author = self.read_string()
-        self.addon_ver, = self.GMA_ADDON_VER.unpack(self.read(self.GMA_ADDON_VER.size)) # unused, i guess
+        self.addon_ver, = self.read_struct(self.GMA_ADDON_VER) # unused, i guess
 
         self.description = ""
         self.type = ""
@@ -368,44 +788,56 @@ class GMAFile(ValveFile):
             # very old maps seem not to have JSON
             self.description = desc
 
-        filenum = 1
         filepos = 0
         while True:
-            fakenum, = self.GMA_FAKE_NUM.unpack(self.read(self.GMA_FAKE_NUM.size))
+            fakenum, = self.read_struct(self.GMA_FAKE_NUM)
             if fakenum == 0:
                 break
             name = fix_slashes(self.read_string())
-            size, crc = self.GMA_FILE_ENT.unpack(self.read(self.GMA_FILE_ENT.size))
-            entry = GMAEntry(filenum, name, filepos, size, crc)
-            self.files.append(entry)
-            mappath : pathlib.PurePath | None = GMAEntry.as_mappath(entry.name)
+            size, crc = self.read_struct(self.GMA_FILE_ENT)
+            self.files.append(name, filepos, size, crc)
+            mappath : pathlib.PurePath | None = GMAEntry.as_mappath(name)
             if mappath is not None:
                 self.maps[mappath] = None
-            thumbpath : pathlib.PurePath | None = GMAEntry.as_thumbpath(entry.name)
+            thumbpath : pathlib.PurePath | None = GMAEntry.as_thumbpath(name)
             if thumbpath is not None:
                 self.thumbs.append(thumbpath)
-            filenum += 1
             filepos += size
 
+        # file data is stored one after the other from here
+        self.datapos = self.tell()
+
         self.filenum = 0
         self.filepos = -1
 
-        self.close()
+        if not keep_open:
+            self.close()
+
+    def start_data(self):
+        # get to the start of the file data.  Only go back if not already there
+        # because for compressed files that means decompressing everything
+        # before it again.
+        self.ensure_open()
+        if self.tell() != self.datapos:
+            self.seek(self.datapos)
+        self.filenum = 0
+        self.filepos = -1
 
     def read_file_data(self, maxread=-1, reading : bool = True):
         if self.filepos < 0:
             if self.filenum == len(self.files):
                 return None
             self.filepos = 0
-            return self.files[self.filenum].name
+            return self.files.name(self.filenum)
 
-        to_read = self.files[self.filenum].size - self.filepos
+        size = self.files.column('size')[self.filenum]
+        to_read = size - self.filepos
         if maxread >= 0 and maxread < to_read:
             to_read = maxread
 
         have_read : int = to_read
         if reading:
-            ret = self.read(to_read)
+            ret = self.read_view(to_read)
             have_read = len(ret)
         else:
             # if not reading, just skip over
@@ -413,17 +845,19 @@ class GMAFile(ValveFile):
             ret = b''
 
         self.filepos += have_read
-        if self.filepos == self.files[self.filenum].size:
+        if self.filepos == size:
             self.filenum += 1
             self.filepos = -1
 
         return ret
 
     def read_all_data(self, dumpstate : DumpGMAFileState):
-        self.reopen()
+        self.start_data()
 
         # open an initial file
         data = self.read_file_data(READ_SIZE)
+        if data is None:
+            return
         if not dumpstate.new_file_cb(data):
             return
 
@@ -441,44 +875,171 @@ class GMAFile(ValveFile):
                 if not dumpstate.data_cb(data):
                     break
 
-    def read_file_set(self, file_set : list[pathlib.PurePath], dumpstate : DumpGMAFileState):
-        self.reopen()
+    def read_file_set(self, file_set : set[pathlib.PurePath], dumpstate : DumpGMAFileState):
+        # stop after the last wanted file instead of going through the rest,
+        # which for compressed files would mean decompressing all of it
+        wanted = 0
+        for name in self.files.names():
+            if pathlib.PurePath(name) in file_set:
+                wanted += 1
+        if wanted == 0:
+            return
 
-        reading : bool = False
+        self.start_data()
 
-        # open an initial file
-        data = self.read_file_data(READ_SIZE)
-        if pathlib.PurePath(data) in file_set:
-            reading = True
-            if not dumpstate.new_file_cb(data):
-                return
+        reading : bool = False
 
         while True:
             data = self.read_file_data(READ_SIZE, reading)
-            if data is None:
-                if reading:
-                    dumpstate.end_file_cb()
-                break
-            elif isinstance(data, str):
+            if data is None or isinstance(data, str):
                 if reading:
+                    reading = False
+                    wanted -= 1
                     if not dumpstate.end_file_cb():
                         break
+                if data is None or wanted == 0:
+                    break
                 if pathlib.PurePath(data) in file_set:
                     reading = True
                     if not dumpstate.new_file_cb(data):
                         break
-                else:
-                    reading = False
+            elif reading:
+                if not dumpstate.data_cb(data):
+                    break
+
+    def get_entry(self, name : str) -> GMAEntry:
+        return self.files.by_name(name)
+
+    def open_entry(self, name : str) -> GMAEntryReader:
+        # read one file without going through the ones before it.  Works on
+        # compressed files too but seeking backwards means decompressing from
+        # the start again.
+        entry = self.get_entry(name)
+        self.ensure_open()
+
+        return GMAEntryReader(self, entry)
+
+    def read_files(self, names : list[str], state : HashFileState):
+        if self.compressed:
+            # seeking in an LZMA stream means decompressing from the start
+            # anyway, so just go through in order
+            self.read_file_set({pathlib.PurePath(name) for name in names}, state)
+            return
+
+        self.start_data()
+
+        positions = self.files.column('pos')
+        sizes = self.files.column('size')
+        for name in names:
+            row = self.files.row(name)
+            self.seek(self.datapos + positions[row])
+            state.new_file_cb(name)
+            self.copy_data(sizes[row], state)
+            state.end_file_cb()
+
+    def get_thumb_maps(self) -> dict[pathlib.PurePath, pathlib.PurePath]:
+        thumbs = {}
+        if len(self.maps) == 1 and len(self.thumbs) == 1:
+            # if there's only 1 thumb and 1 map, just assign them even if the names don't match
+            # I don't know if this is correct, but some are packaged this way
+            thumbs[self.thumbs[0]] = list(self.maps.keys())[0]
+        else:
+            for mappath in self.maps.keys():
+                for thumb in self.thumbs:
+                    if mappath.stem == thumb.stem:
+                        thumbs[thumb] = mappath
+        return thumbs
+
+    def get_thumb_crcs(self) -> dict[pathlib.PurePath, int]:
+        crcs = {}
+        for name, crc in zip(self.files.names(), self.files.column('crc')):
+            path = GMAEntry.as_thumbpath(name)
+            if path is not None:
+                crcs[path] = crc
+        return crcs
+
+    def load_thumbs(self, thumb_width : int, thumb_cache : ThumbCache | None):
+        # fills in maps with thumbnails, either already rendered from the
+        # cache or the image data to be rendered, only when they're needed
+        if self.thumbs_loaded:
+            return
+        self.thumbs_loaded = True
+
+        thumbs = self.get_thumb_maps()
+        if thumb_cache is not None:
+            # already rendered ones don't need to be extracted
+            crcs = self.get_thumb_crcs()
+            for thumb, gmap in list(thumbs.items()):
+                if crcs[thumb] != 0:
+                    image = thumb_cache.get(self.workshop_id, thumb, crcs[thumb], thumb_width)
+                    if image is not None:
+                        self.maps[gmap] = image
+                        del thumbs[thumb]
+
+        if len(thumbs) > 0:
+            if self.compressed:
+                # go through in one pass instead of decompressing from the
+                # start for each one
+                self.read_file_set(set(thumbs.keys()), DumpGMAFileState(self.path, False, self.maps, thumbs))
             else:
-                if reading:
-                    if not dumpstate.data_cb(data):
-                        break
+                for name in self.files.names():
+                    path = GMAEntry.as_thumbpath(name)
+                    if path in thumbs:
+                        with self.open_entry(name) as infile:
+                            self.maps[thumbs[path]] = infile.read()
+            self.close()
+
+    def get_info(self):
+        # everything from the header but the file table, which is saved with
+        # get_packed(), to make a GMAFile again without parsing it
+        return {'workshop_id': self.workshop_id,
+                'version': self.version,
+                'steamid': self.steamid,
+                'timestamp': self.timestamp,
+                'name': self.name,
+                'author': self.author,
+                'type': self.type,
+                'tags': self.tags,
+                'description': self.description,
+                'addon_ver': self.addon_ver,
+                'datapos': self.datapos,
+                'maps': [str(gmap) for gmap in self.maps.keys()],
+                'thumbs': [str(thumb) for thumb in self.thumbs]}
+
+    def from_info(path : pathlib.PurePath, compressed : bool, stat : os.stat_result, info : dict, files : bytes) -> GMAFile:
+        # files is from get_packed() on the file table
+        gma = GMAFile.__new__(GMAFile)
+        gma.init_closed(path, compressed)
+        gma.set_stat(stat)
+        gma.path = path
+
+        gma.workshop_id = info['workshop_id']
+        gma.version = info['version']
+        gma.steamid = info['steamid']
+        gma.timestamp = info['timestamp']
+        gma.name = info['name']
+        gma.author = info['author']
+        gma.type = info['type']
+        gma.tags = info['tags']
+        gma.description = info['description']
+        gma.addon_ver = info['addon_ver']
+        gma.datapos = info['datapos']
+        gma.files = GMAFileTable()
+        gma.files.set_packed(files)
+        gma.maps = {pathlib.PurePath(gmap): None for gmap in info['maps']}
+        gma.thumbs = [pathlib.PurePath(thumb) for thumb in info['thumbs']]
+        gma.thumbs_loaded = False
+
+        gma.filenum = 0
+        gma.filepos = -1
+
+        return gma
 
     def get_url(self):
         return f"https://steamcommunity.com/sharedfiles/filedetails/?id={self.workshop_id}"
 
     def get_file_set(self):
-        return {file.name for file in self.files}
+        return set(self.files.names())
 
     def __str__(self):
         timestamp = time.asctime(time.gmtime(self.timestamp))
@@ -516,7 +1077,7 @@ class GMAFile(ValveFile):
                 'tags': self.tags,
                 'description': self.description,
                 'addon_ver': self.addon_ver,
-                'files': [{'name': file.name, 'size': file.size} for file in self.files]}
+                'files': [{'name': name, 'size': size} for name, size in zip(self.files.names(), self.files.column('size'))]}
 
 @dataclass
 class VPKEntry():
@@ -525,12 +1086,87 @@ class VPKEntry():
     preload_bytes : int
     archive_offset : int
     archive_bytes : int
+    crc : int
+
+class VPKFileTable(FileTable):
+    COLUMNS = (('archive', 'H'),
+               ('preload_pos', 'Q'),
+               ('preload_bytes', 'H'),
+               ('archive_offset', 'L'),
+               ('archive_bytes', 'L'),
+               ('crc', 'L'))
+
+    def entry(self, row : int) -> VPKEntry:
+        return VPKEntry(*(column[row] for column in self.columns.values()))
+
+class VPKArchivePool:
+    # open _NNN.vpk archives of a VPK set, so reading a bunch of entries
+    # doesn't open and close an archive for every one of them.  The least
+    # recently used one gets closed once too many are open.
+
+    def get(self, num : int) -> ValveFile:
+        archive = self.archives.get(num)
+        if archive is None:
+            if len(self.archives) >= self.max_open:
+                _, oldest = self.archives.popitem(last=False)
+                oldest.close()
+            archive = ValveFile(pathlib.Path(self.parent, f"{self.name}_{num:03d}.vpk"))
+            self.archives[num] = archive
+        else:
+            self.archives.move_to_end(num)
+
+        return archive
+
+    def close(self):
+        for archive in self.archives.values():
+            archive.close()
+        self.archives.clear()
+
+    def __init__(self, parent : pathlib.PurePath, name : str, max_open : int = VPK_OPEN_ARCHIVES):
+        self.parent = parent
+        self.name = name
+        self.max_open = max_open
+        self.archives = collections.OrderedDict()
+
+class VPKEntryReader(EntryReader):
+    # the preload bytes stored in the directory come first, then whatever is
+    # in the archive
+
+    def read(self, count : int = -1) -> bytes:
+        remaining = self.size - self.pos
+        if count < 0 or count > remaining:
+            count = remaining
+
+        data = b''
+        if count > 0 and self.pos < self.entry.preload_bytes:
+            to_read = min(count, self.entry.preload_bytes - self.pos)
+            self.vpk.seek(self.entry.preload_pos + self.pos)
+            data = self.vpk.read(to_read)
+            self.pos += len(data)
+            if len(data) < to_read:
+                # truncated file
+                return data
+            count -= len(data)
+
+        if count > 0:
+            archive, base = self.vpk.get_archive(self.entry.archive)
+            target = base + self.entry.archive_offset + self.pos - self.entry.preload_bytes
+            if archive.tell() != target:
+                archive.seek(target)
+            buf = archive.read(count)
+            self.pos += len(buf)
+            data += buf
+
+        return data
+
+    def __init__(self, vpk : VPKFile, entry : VPKEntry):
+        super().__init__(entry.preload_bytes + entry.archive_bytes)
+        self.vpk = vpk
+        self.entry = entry
 
 class VPKFile(ValveFile):
     # much from <https://developer.valvesoftware.com/wiki/VPK_(file_format)>
 
-    # this'll be super basic and only read the directory tree
-
     DIRECTORY_SUFFIX = "_dir.vpk"
     THIS_ARCHIVE = 0x7FFF
 
@@ -542,32 +1178,38 @@ class VPKFile(ValveFile):
     VPK_ENTRY = struct.Struct("<IHHIIH")
 
     def __init__(self, path : pathlib.PurePath):
-        # no compression here but the in-place string reading from a binary file is still useful
-        super().__init__(path)
-
         self.parent = path.parent
         self.name = path.name[:-len(VPKFile.DIRECTORY_SUFFIX)]
+        self.archives = VPKArchivePool(self.parent, self.name)
 
-        self.files = {}
+        # no compression here but the in-place string reading from a binary file is still useful
+        super().__init__(path)
 
-        magic, version = self.VPK_MAGIC_HDR.unpack(self.read(self.VPK_MAGIC_HDR.size))
+        self.files = VPKFileTable()
+
+        magic, version = self.read_struct(self.VPK_MAGIC_HDR)
 
         if magic != self.VPK_MAGIC:
             # probably a data file, not a directory
             self.files = None
+            self.close()
             return
 
         if version == 1:
-            self.treesize = self.VPK_1_HDR.unpack(self.read(self.VPK_1_HDR.size))
+            self.treesize, = self.read_struct(self.VPK_1_HDR)
         elif version == 2:
             # don't care about the signatures
-            self.treesize, _, _, _, _ = self.VPK_2_HDR.unpack(self.read(self.VPK_2_HDR.size))
+            self.treesize, _, _, _, _ = self.read_struct(self.VPK_2_HDR)
         else:
             # unrecognized version, but a data file could in theory start with
             # the header bytes so just act like nothing happened
             self.files = None
+            self.close()
             return
 
+        # data stored in the directory file starts after the tree
+        self.datapos = self.tell() + self.treesize
+
         while True:
             extension = self.read_string()
             if extension == "":
@@ -588,118 +1230,282 @@ class VPKFile(ValveFile):
                     filename = self.read_string()
                     if filename == "":
                         break
-                    _, preloadBytes, archiveIndex, entryOffset, entryLength, _ = self.VPK_ENTRY.unpack(self.read(self.VPK_ENTRY.size))
-                    self.files[f"{path}{filename}{extension}"] = VPKEntry(archiveIndex, self.tell(), preloadBytes, entryOffset, entryLength)
+                    crc, preloadBytes, archiveIndex, entryOffset, entryLength, _ = self.read_struct(self.VPK_ENTRY)
+                    self.files.append(f"{path}{filename}{extension}", archiveIndex, self.tell(), preloadBytes, entryOffset, entryLength, crc)
                     if preloadBytes > 0:
                         self.seek(preloadBytes, os.SEEK_CUR)
 
         self.close()
 
-    def read_all_data(self, new_file_cb, data_cb, end_file_cb, priv):
-        self.reopen()
-
-        for name in self.files.keys():
-            file = self.files[name]
-            new_file_cb(priv, name)
+    def read_all_data(self, state : HashFileState):
+        self.read_files(self.files.names(), state)
+
+    def get_archive(self, num : int) -> tuple[ValveFile, int]:
+        # the file an archive number refers to and where its offsets start from
+        if num == VPKFile.THIS_ARCHIVE:
+            return self, self.datapos
+
+        return self.archives.get(num), 0
+
+    def physical_rows(self, names : collections.abc.Iterable[str]) -> list[int]:
+        # sort by where the data actually is so each archive is read start to
+        # finish.  Files that are only preload data go first, in the order
+        # they are in the directory.
+        archives = self.files.column('archive')
+        preload_positions = self.files.column('preload_pos')
+        offsets = self.files.column('archive_offset')
+        archive_sizes = self.files.column('archive_bytes')
+        def location(row : int) -> tuple[int, int]:
+            if archive_sizes[row] == 0:
+                return (-1, preload_positions[row])
+            return (archives[row], offsets[row])
+
+        return sorted((self.files.row(name) for name in names), key=location)
+
+    def physical_order(self, names : collections.abc.Iterable[str]) -> list[str]:
+        return [self.files.name(row) for row in self.physical_rows(names)]
+
+    def open_entry(self, name : str) -> VPKEntryReader:
+        entry = self.files.by_name(name)
+        self.ensure_open()
+
+        return VPKEntryReader(self, entry)
+
+    def get_runs(self, names : collections.abc.Iterable[str]) -> list[list[int]]:
+        # group entries that are next to each other in the same archive so
+        # they can be read all at once
+        runs = []
+        start = end = 0
+        archive = None
+        for row in self.physical_rows(names):
+            file = self.files.entry(row)
+            if file.archive_bytes == 0:
+                # only preload data, which is in the directory tree
+                runs.append([row])
+                archive = None
+                continue
+            gap = file.archive_offset - end
+            if file.archive != archive or gap < 0 or gap > VPK_RUN_GAP or \
+               file.archive_offset + file.archive_bytes - start > VPK_RUN_SIZE:
+                runs.append([])
+                archive = file.archive
+                start = file.archive_offset
+            runs[-1].append(row)
+            end = file.archive_offset + file.archive_bytes
+
+        return runs
+
+    def read_run(self, rows : list[int], state : HashFileState):
+        first = self.files.entry(rows[0])
+        last = self.files.entry(rows[-1])
+        data = None
+        if first.archive_bytes > 0:
+            archive, base = self.get_archive(first.archive)
+            start = first.archive_offset
+            end = last.archive_offset + last.archive_bytes
+            if end - start <= VPK_RUN_SIZE:
+                # read the whole run and hand out pieces of it.  If it's mapped
+                # this doesn't copy anything but the kernel still gets to read
+                # it all in one go.
+                archive.will_need(base + start, end - start)
+                archive.seek(base + start)
+                data = memoryview(archive.read_view(end - start))
+
+        for row in rows:
+            file = self.files.entry(row)
+            state.new_file_cb(self.files.name(row))
             if file.preload_bytes > 0:
                 self.seek(file.preload_pos)
-                remaining = file.preload_bytes
-                while remaining > 0:
-                    to_read = remaining
-                    if to_read > READ_SIZE:
-                        to_read = READ_SIZE
-                    data = self.read(to_read)
-                    data_cb(priv, data)
-                    remaining -= len(data)
+                self.copy_data(file.preload_bytes, state)
             if file.archive_bytes > 0:
-                infile = self
-                if file.archive == VPKFile.THIS_ARCHIVE:
-                    self.seek(self.treesize + file.archive_offset)
+                if data is None:
+                    # too big to take in one piece
+                    archive.seek(base + file.archive_offset)
+                    archive.copy_data(file.archive_bytes, state)
                 else:
-                    infile = pathlib.Path(self.parent, f"{self.name}_{file.archive:03d}.vpk").open('rb')
-                    infile.seek(file.archive_offset)
-                remaining = file.archive_bytes
-                while remaining > 0:
-                    to_read = remaining
-                    if to_read > READ_SIZE:
-                        to_read = READ_SIZE
-                    data = infile.read(to_read)
-                    data_cb(priv, data)
-                    remaining -= len(data)
-                if infile is not self:
-                    infile.close()
-            end_file_cb(priv)
-
-def parse_acf_file(path : pathlib.PurePath):
-    root = {}
+                    pos = file.archive_offset - start
+                    state.data_cb(data[pos:pos+file.archive_bytes])
+            state.end_file_cb()
 
-    with pathlib.Path(path).open('r') as infile:
-        ln = 0
+        if data is not None:
+            # don't hold the archive's map open
+            data.release()
 
-        key = None
-        current = [root]
-        while True:
-            line = infile.readline()
-            if line == "":
-                break
-            line = line.strip()
-            ln += 1
-
-            while len(line) > 0:
-                if key == None:
-                    if line.startswith("\""):
-                        quote = line[1:].index("\"")
-                        key = line[1:quote+1]
-                        line = line[quote+2:].lstrip()
-                    elif line.startswith("}"):
-                        current = current[:-1]
-                        line = line[1:].lstrip()
-                    else:
-                        raise ValueError(f"Expected key in parsing ACF file ({ln}).")
-                else:
-                    if line.startswith("\""):
-                        quote = line[1:].index("\"")
-                        current[-1][key] = line[1:quote+1]
-                        line = line[quote+2:].lstrip()
-                    elif line.startswith("{"):
-                        # create a dict in the current dict
-                        current[-1][key] = {}
-                        # make the same new dict the current dict
-                        current.append(current[-1][key])
-                        line = line[1:].lstrip()
-                    else:
-                        raise ValueError(f"Expected value in parsing ACF file ({ln}).")
-                    key = None
+    def read_files(self, names : list[str], state : HashFileState):
+        self.reopen()
 
-    return root
+        for run in self.get_runs(names):
+            self.read_run(run, state)
 
-def get_gma_paths(steampath : str):
-    modspath = pathlib.Path(steampath, STEAM_WORKSHOP_PATH)
-    paths = []
+    def close(self):
+        super().close()
+        self.archives.close()
+
+    def __getstate__(self):
+        state = super().__getstate__()
+        # clones and other processes get their own archive handles
+        state['archives'] = VPKArchivePool(self.parent, self.name)
+        return state
+
+# quoted string, brace, unquoted string, // comment or [$PLATFORM] conditional
+# to skip over, or a stray quote from an unterminated string
+ACF_TOKEN = re.compile(r'\s*(?:"([^"\\]*(?:\\.[^"\\]*)*)"|([{}])|(//[^\n]*|\[\$[^\]]*\])|([^\s"{}]+)|("))')
+ACF_ESCAPE = re.compile(r'\\(.)')
+ACF_ESCAPES = {'n': '\n', 't': '\t'}
+
+# path -> (mtime, size, parsed), so files read more than once in a run are
+# only parsed once.  What's returned is shared, so don't modify it.
+acf_cache : dict[str, tuple[int, int, dict]] = {}
+
+def acf_error(text : str, num : int, message : str) -> ValueError:
+    # only figure out where it happened when there's an error
+    for i, token in enumerate(ACF_TOKEN.finditer(text)):
+        if i == num:
+            return ValueError(f"{message} in parsing ACF file ({text.count('\n', 0, token.end()) + 1}).")
+
+    return ValueError(f"{message} in parsing ACF file.")
+
+def parse_acf_file(path : pathlib.PurePath) -> dict:
+    path = pathlib.Path(path)
+    stat = path.stat()
+    cached = acf_cache.get(str(path))
+    if cached is not None and cached[0] == stat.st_mtime_ns and cached[1] == stat.st_size:
+        return cached[2]
+
+    text = path.read_text(encoding='utf-8', errors='replace')
 
-    for item in modspath.iterdir():
-        if not (item.is_dir() and item.name.isdecimal()):
-            paths.append(f"{item.name} is probably not a mod directory (non-numeric name).")
+    root = {}
+    key = None
+    current = [root]
+    for num, (string, brace, skip, bare, stray) in enumerate(ACF_TOKEN.findall(text)):
+        if skip:
             continue
+        if stray:
+            raise acf_error(text, num, "Unterminated string")
+        if bare:
+            string = bare
+        elif '\\' in string:
+            string = ACF_ESCAPE.sub(lambda m: ACF_ESCAPES.get(m.group(1), m.group(1)), string)
+
+        if key is None:
+            if brace == '}':
+                if len(current) == 1:
+                    raise acf_error(text, num, "Unmatched }")
+                current.pop()
+            elif brace == '{':
+                raise acf_error(text, num, "Expected key")
+            else:
+                key = string
+        else:
+            if brace == '{':
+                # create a dict in the current dict and make it the current dict
+                current[-1][key] = {}
+                current.append(current[-1][key])
+            elif brace == '}':
+                raise acf_error(text, num, "Expected value")
+            else:
+                current[-1][key] = string
+            key = None
 
-        gmas = list(item.glob("*.gma", case_sensitive=False))
-        gmas.extend(item.glob("*_legacy.bin", case_sensitive=False))
+    acf_cache[str(path)] = (stat.st_mtime_ns, stat.st_size, root)
 
-        if len(gmas) == 0:
-            try:
-                _ = item.iterdir().__next__()
-                paths.append(f"No GMA files in {item.name}.")
-            except StopIteration:
-                paths.append(f"Empty direcotry in {item.name}.")
-            continue
+    return root
 
-        if len(gmas) > 1:
-            paths.append(f"Multiple GMA files in {item.name}.")
+def get_library_paths(steampath : pathlib.PurePath) -> list[pathlib.Path]:
+    libraries = [pathlib.Path(steampath)]
+
+    try:
+        folders = parse_acf_file(pathlib.PurePath(steampath, LIBRARY_FOLDERS_PATH))
+    except FileNotFoundError:
+        return libraries
+    except ValueError as e:
+        log_print(f"WARNING: Couldn't read library folders: {e}")
+        return libraries
+
+    # older ones were capitalized and just had the path as the value
+    folders = folders.get("libraryfolders", folders.get("LibraryFolders", {}))
+    seen = {os.path.realpath(steampath)}
+    for key, value in folders.items():
+        if not key.isdecimal():
+            continue
+        if isinstance(value, dict):
+            value = value.get("path")
+        if value is None:
             continue
+        realpath = os.path.realpath(value)
+        if realpath not in seen and os.path.isdir(realpath):
+            seen.add(realpath)
+            libraries.append(pathlib.Path(value))
+
+    return libraries
+
+def find_app_library(libraries : list[pathlib.Path], appid : int) -> pathlib.Path | None:
+    for library in libraries:
+        if pathlib.Path(library, "steamapps", f"appmanifest_{appid}.acf").is_file():
+            return library
+
+    return None
+
+def scan_dir(path : str) -> tuple[list[tuple[str, int]], list[str]]:
+    # one directory's files with sizes and its subdirectories.  Symlinks are
+    # treated as files like Path.walk() does, and scandir's stat is used so
+    # there's no extra lookup by name.
+    files = []
+    dirs = []
+
+    try:
+        with os.scandir(path) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        dirs.append(entry.name)
+                    else:
+                        files.append((entry.name, entry.stat().st_size))
+                except OSError:
+                    # broken symlink or whatever
+                    pass
+    except OSError:
+        pass
+
+    return files, dirs
+
+def scan_workshop_item(item : pathlib.Path, is_dir : bool) -> pathlib.Path | str:
+    if not (is_dir and item.name.isdecimal()):
+        return f"{item.name} is probably not a mod directory (non-numeric name)."
+
+    files, dirs = scan_dir(str(item))
+    if len(files) == 0 and len(dirs) == 0:
+        return f"Empty direcotry in {item.name}."
 
-        paths.append(gmas[0])
+    gmas = [name for name, _ in files if name.lower().endswith((".gma", "_legacy.bin"))]
+    if len(gmas) == 0:
+        return f"No GMA files in {item.name}."
+    if len(gmas) > 1:
+        return f"Multiple GMA files in {item.name}."
 
-    return paths
+    return pathlib.Path(item, gmas[0])
+
+def get_gma_paths(steampath : str):
+    items = []
+    is_dirs = []
+    found = False
+    for library in get_library_paths(steampath):
+        modspath = pathlib.Path(library, STEAM_WORKSHOP_PATH)
+        try:
+            with os.scandir(modspath) as entries:
+                for entry in entries:
+                    items.append(pathlib.Path(modspath, entry.name))
+                    is_dirs.append(entry.is_dir())
+            found = True
+        except FileNotFoundError:
+            pass
+
+    if not found:
+        return ["No workshop directory found in any steam library."]
+
+    # looking in each one is mostly waiting on the disk
+    with concurrent.futures.ThreadPoolExecutor(LIST_WORKERS) as executor:
+        return list(executor.map(scan_workshop_item, items, is_dirs))
 
 def _get_gma_infos(path, do_only=[]):
     paths = get_gma_paths(path)
@@ -725,34 +1531,27 @@ class DumpGMAFileState():
     thumbs : dict[pathlib.PurePath, pathlib.PurePath] | None
     current_name : pathlib.PurePath | None
     current_data : bytes
+    made_dirs : set[pathlib.Path]
 
     def __init__(self, path : pathlib.PurePath,
                        do_dump : bool,
                        maps : dict[pathlib.PurePath, str | None] | None,
-                       thumbs : list[pathlib.PurePath] | None):
+                       thumbs : dict[pathlib.PurePath, pathlib.PurePath] | None):
         self.path = path
         self.file = None
         self.do_dump = do_dump
-        self.thumbs = None
-        if maps is not None and thumbs is not None:
-            self.maps = maps
-            self.thumbs = {}
-            if len(maps) == 1 and len(thumbs) == 1:
-                # if there's only 1 thumb and 1 map, just assign them even if the names don't match
-                # I don't know if this is correct, but some are packaged this way
-                self.thumbs[thumbs[0]] = list(self.maps.keys())[0]
-            else:
-                for mappath in self.maps.keys():
-                    for thumb in thumbs:
-                        if mappath.stem == thumb.stem:
-                            self.thumbs[thumb] = mappath
+        self.maps = maps
+        self.thumbs = thumbs
         self.current_name = None
         self.current_data = b''
+        self.made_dirs = set()
 
     def new_file_cb(self, name):
-        if do_dump:
+        if self.do_dump:
             extract_path = pathlib.Path(self.path.parent.name, pathlib.Path(name))
-            extract_path.parent.mkdir(parents=True, exist_ok=True)
+            if extract_path.parent not in self.made_dirs:
+                extract_path.parent.mkdir(parents=True, exist_ok=True)
+                self.made_dirs.add(extract_path.parent)
             self.file = extract_path.open('wb')
 
         if self.thumbs is not None and len(self.thumbs) > 0:
@@ -763,7 +1562,7 @@ class DumpGMAFileState():
         return True
 
     def data_cb(self, data):
-        if do_dump:
+        if self.do_dump:
             self.file.write(data)
 
         if self.current_name is not None:
@@ -772,12 +1571,12 @@ class DumpGMAFileState():
         return True
 
     def end_file_cb(self):
-        if do_dump:
+        if self.do_dump:
             self.file.close()
 
         if self.current_name is not None:
             self.maps[self.thumbs[self.current_name]] = self.current_data
-            if not do_dump:
+            if not self.do_dump:
                 # if not dumping and all thumbnails are extracted, stop extracting.
                 all_none = True
                 for gmap in self.maps.keys():
@@ -791,20 +1590,227 @@ class DumpGMAFileState():
 
         return True
 
-def image_to_octants(name : str, data : bytes, thumb_width : int) -> str | None:
-    error_r : float = 0.0
-    error_g : float = 0.0
-    error_b : float = 0.0
+def copy_range(infile : io.BufferedReader, outfile : io.RawIOBase, offset : int, count : int) -> int:
+    # let the kernel copy it if it can, otherwise fall back to copying through
+    # a small buffer.  outfile should be unbuffered so it stays at the same
+    # place as its file descriptor if the kernel copy gives up partway.
+    copied = 0
+    use_kernel = hasattr(os, 'copy_file_range') or hasattr(os, 'sendfile')
+    while copied < count:
+        done = 0
+        if use_kernel:
+            try:
+                if hasattr(os, 'copy_file_range'):
+                    done = os.copy_file_range(infile.fileno(), outfile.fileno(), count - copied, offset + copied)
+                else:
+                    done = os.sendfile(outfile.fileno(), infile.fileno(), offset + copied, count - copied)
+            except OSError:
+                # different filesystems, not supported, whatever
+                use_kernel = False
+                continue
+        else:
+            infile.seek(offset + copied)
+            data = infile.read(min(count - copied, READ_SIZE))
+            if len(data) > 0:
+                done = outfile.write(data)
+        if done == 0:
+            # truncated file
+            break
+        copied += done
+
+    return copied
+
+def read_dump_manifest(extract_dir : pathlib.Path) -> dict[str, list[int]]:
     try:
-        image : Image = Image.open(io.BytesIO(data))
-    except UnidentifiedImageError:
-        log_print(f"WARNING: Couldn't load thumbnail image for map {name}.")
+        with pathlib.Path(extract_dir, DUMP_MANIFEST_NAME).open('r') as infile:
+            manifest = json.load(infile)
+        if manifest['version'] == DUMP_MANIFEST_VERSION:
+            return manifest['files']
+    except (FileNotFoundError, json.decoder.JSONDecodeError, KeyError, TypeError):
+        pass
 
-        return None
+    return {}
+
+def write_dump_manifest(extract_dir : pathlib.Path, gma : GMAFile):
+    path = pathlib.Path(extract_dir, DUMP_MANIFEST_NAME)
+    tmppath = path.with_name(f"{path.name}.tmp")
+    with tmppath.open('w') as outfile:
+        json.dump({'version': DUMP_MANIFEST_VERSION,
+                   'files': {name: [size, crc] for name, size, crc in zip(gma.files.names(),
+                                                                          gma.files.column('size'),
+                                                                          gma.files.column('crc'))}}, outfile)
+    os.replace(tmppath, path)
+
+def is_dumped(extract_dir : pathlib.Path, file : GMAEntry, manifest : dict[str, list[int]]) -> bool:
+    # without a CRC there's no telling if it changed
+    if file.crc == 0 or manifest.get(file.name) != [file.size, file.crc]:
+        return False
 
-    width : int = math.ceil(thumb_width / 2) * 2
-    height : int = math.ceil(image.height / image.width * width / 4) * 4
-    image = image.convert('RGB').resize((width, height))
+    try:
+        return pathlib.Path(extract_dir, file.name).stat().st_size == file.size
+    except FileNotFoundError:
+        return False
+
+def dump_gma(gma : GMAFile, do_thumbs : bool, do_sync : bool):
+    # runs in a worker thread, each worker has its own GMA
+    extract_dir = pathlib.Path(gma.path.parent.name)
+
+    files = gma.files
+    if do_sync:
+        manifest = read_dump_manifest(extract_dir)
+        files = [file for file in gma.files if not is_dumped(extract_dir, file, manifest)]
+
+        # get rid of what was dumped before but isn't in the addon any more
+        names = gma.get_file_set()
+        root = extract_dir.resolve()
+        for name in manifest.keys():
+            if name not in names:
+                # names come from the addon, so make sure they don't point
+                # anywhere outside of it.  Only the directory is resolved so a
+                # link would be removed and not what it points to.
+                path = pathlib.Path(extract_dir, name)
+                if path.name in ('', '.', '..'):
+                    continue
+                path = pathlib.Path(path.parent.resolve(), path.name)
+                if not path.parent.is_relative_to(root):
+                    continue
+                path.unlink(missing_ok=True)
+                # and whatever directories that left empty
+                for parent in path.parents:
+                    if parent == root or not parent.is_relative_to(root):
+                        break
+                    try:
+                        parent.rmdir()
+                    except OSError:
+                        break
+
+    if gma.compressed:
+        if len(files) == len(gma.files):
+            # has to be decompressed in order anyway, so go through it once and
+            # pick up the thumbnails while at it
+            maps = None
+            thumbs = None
+            if do_thumbs:
+                maps = gma.maps
+                thumbs = gma.get_thumb_maps()
+                gma.thumbs_loaded = True
+            gma.read_all_data(DumpGMAFileState(gma.path, True, maps, thumbs))
+        elif len(files) > 0:
+            gma.read_file_set({pathlib.PurePath(file.name) for file in files},
+                              DumpGMAFileState(gma.path, True, None, None))
+        gma.close()
+    else:
+        # thumbnails are cheap to get at later with open_entry()
+        gma.close()
+        for path in sorted({pathlib.Path(extract_dir, file.name).parent for file in files}):
+            path.mkdir(parents=True, exist_ok=True)
+
+        with gma.path.open('rb') as infile:
+            for file in files:
+                with pathlib.Path(extract_dir, file.name).open('wb', buffering=0) as outfile:
+                    copy_range(infile, outfile, gma.datapos + file.pos, file.size)
+
+    extract_dir.mkdir(parents=True, exist_ok=True)
+    write_dump_manifest(extract_dir, gma)
+
+def octants_numpy(image : Image) -> str:
+    width, height = image.size
+    cols = width // 2
+    rows = height // 4
+
+    # split in to cells[row, column, pixel, channel] with the pixels in each
+    # 2x4 cell going left to right then top to bottom
+    cells = numpy.asarray(image, dtype=numpy.float64) \
+                 .reshape(rows, 4, cols, 2, 3) \
+                 .transpose(0, 2, 1, 3, 4) \
+                 .reshape(rows, cols, 8, 3)
+
+    # each cell gets error from the cell to its left and the cells above it
+    # and above and to the right, so go along diagonals where all the cells
+    # it depends on are already done and do each diagonal all at once.
+    # everything is skewed so diagonal t is [t, row] and cells off the edge
+    # are just blank
+    diagonals = cols + (rows - 1) * 2
+    row = numpy.arange(rows)
+    skew_t = numpy.arange(cols)[None, :] + (row[:, None] * 2)
+    col = numpy.arange(diagonals)[:, None] - (row[None, :] * 2)
+    valid = (col >= 0) & (col < cols)
+    has_left = valid & (col > 0)
+    has_upright = valid & (row[None, :] > 0) & (col + 1 < cols)
+    skewed = numpy.zeros((diagonals, rows, 8, 3))
+    skewed[skew_t, row[:, None]] = cells
+    # padded by 2 diagonals and 1 row in front so the neighbors can just be sliced
+    errors = numpy.zeros((diagonals + 2, rows + 1, 8, 3))
+    bgs = numpy.zeros((diagonals, rows, 3))
+    fgs = numpy.zeros((diagonals, rows, 3))
+    is_fg = numpy.zeros((diagonals, rows, 8), dtype=bool)
+
+    for t in range(diagonals):
+        left = errors[t + 1, 1:]
+        up = errors[t, :-1]
+        upright = errors[t + 1, :-1]
+
+        # same weights as the slow version, where a pixel is written more than
+        # once only the last write counts
+        block = skewed[t].copy()
+        block[:, 0] += numpy.where(has_left[t, :, None], left[:, 3] / 4.0, up[:, 7] / 2.0)
+        block[:, 1] += numpy.where(has_upright[t, :, None], upright[:, 7], up[:, 7]) / 4.0
+        block[:, 2] += left[:, 5] / 4.0
+        block[:, 4] += left[:, 6] / 7.0
+        block[:, 6] += left[:, 6] / 7.0 * 2.0
+        numpy.maximum(block, 0.0, out=block)
+        numpy.minimum(block, 255.0, out=block)
+        numpy.floor(block, out=block)
+
+        # split each cell along whichever channel varies the most, then give
+        # each pixel whichever half's average is closer
+        channel = (block.max(axis=1) - block.min(axis=1)).argmax(axis=1)
+        values = block[row, :, channel]
+        upper = values * 8.0 > values.sum(axis=1, keepdims=True)
+        count = upper.sum(axis=1, keepdims=True)
+        upper_sum = numpy.einsum('np,npc->nc', upper, block)
+        bg = numpy.rint((block.sum(axis=1) - upper_sum) / (8 - count))
+        fg = numpy.where(count > 0, numpy.rint(upper_sum / numpy.maximum(count, 1)), bg)
+        cell_fg = numpy.einsum('npc,nc->np', block, bg - fg) * 2.0 < ((bg * bg) - (fg * fg)).sum(axis=1, keepdims=True)
+
+        bgs[t] = bg
+        fgs[t] = fg
+        is_fg[t] = cell_fg
+        errors[t + 2, 1:] = (numpy.where(cell_fg[..., None], fg[:, None], bg[:, None]) - skewed[t]) * valid[t, :, None, None]
+
+    bgs = bgs[skew_t, row[:, None]]
+    fgs = fgs[skew_t, row[:, None]]
+    is_fg = is_fg[skew_t, row[:, None]]
+
+    single = (bgs == fgs).all(axis=2).tolist()
+    chars = (is_fg * OCTANT_BITS).sum(axis=2).tolist()
+    bgs = bgs.astype(int).tolist()
+    fgs = fgs.astype(int).tolist()
+
+    thumbdata = []
+    for y in range(rows):
+        lastpal = None
+        for x in range(cols):
+            if single[y][x]:
+                pal = bgs[y][x]
+                if lastpal != pal:
+                    thumbdata.append(f"\x1b[48;2;{pal[0]};{pal[1]};{pal[2]}m")
+                thumbdata.append(" ")
+            else:
+                pal = bgs[y][x] + fgs[y][x]
+                if lastpal != pal:
+                    thumbdata.append(f"\x1b[48;2;{pal[0]};{pal[1]};{pal[2]}m\x1b[38;2;{pal[3]};{pal[4]};{pal[5]}m")
+                thumbdata.append(CHARS4[chars[y][x]])
+            lastpal = pal
+        thumbdata.append("\x1b[m\n")
+
+    return ''.join(thumbdata)
+
+def octants_pil(image : Image) -> str:
+    error_r : float = 0.0
+    error_g : float = 0.0
+    error_b : float = 0.0
+    width, height = image.size
     imgdata = image.get_flattened_data()
     thumbdata = ""
     for y in range(0, height, 4):
@@ -931,15 +1937,95 @@ def image_to_octants(name : str, data : bytes, thumb_width : int) -> str | None:
     
     return thumbdata
 
-def print_maps(gma : GMAFile, thumb_width : int):
+def image_to_octants(name : str, data : bytes, thumb_width : int) -> str | None:
+    try:
+        image : Image = Image.open(io.BytesIO(data))
+    except UnidentifiedImageError:
+        log_print(f"WARNING: Couldn't load thumbnail image for map {name}.")
+
+        return None
+
+    width : int = math.ceil(thumb_width / 2) * 2
+    height : int = math.ceil(image.height / image.width * width / 4) * 4
+    image = image.convert('RGB').resize((width, height))
+
+    if numpy is not None:
+        return octants_numpy(image)
+
+    return octants_pil(image)
+
+class ThumbCache:
+    # rendered thumbnails keyed on workshop ID, the thumbnail's CRC and the
+    # width it was rendered at
+
+    def get(self, workshop_id : int, name : pathlib.PurePath, crc : int, width : int) -> str | None:
+        row = self.db.execute("SELECT rowid, data FROM thumbs WHERE workshop_id = ? AND name = ? AND crc = ? AND width = ?",
+                              (workshop_id, str(name), crc, width)).fetchone()
+        if row is None:
+            return None
+
+        self.used[row[0]] = time.time()
+        return row[1].decode('utf-8')
+
+    def put(self, workshop_id : int, name : pathlib.PurePath, crc : int, width : int, data : str):
+        self.db.execute("INSERT OR REPLACE INTO thumbs (workshop_id, name, crc, width, used, data) VALUES (?, ?, ?, ?, ?, ?)",
+                        (workshop_id, str(name), crc, width, time.time(), data.encode('utf-8')))
+
+    def close(self):
+        self.db.executemany("UPDATE thumbs SET used = ? WHERE rowid = ?",
+                            ((used, rowid) for rowid, used in self.used.items()))
+
+        # throw out whatever was used longest ago until it fits
+        total = 0
+        evict = []
+        for rowid, size in self.db.execute("SELECT rowid, length(data) FROM thumbs ORDER BY used DESC"):
+            total += size
+            if total > THUMB_CACHE_SIZE:
+                evict.append((rowid,))
+        self.db.executemany("DELETE FROM thumbs WHERE rowid = ?", evict)
+
+        self.db.commit()
+        self.db.close()
+
+    def __init__(self, path : str):
+        self.db = sqlite3.connect(path)
+        self.db.execute("CREATE TABLE IF NOT EXISTS thumbs (workshop_id INTEGER, name TEXT, crc INTEGER, width INTEGER, used REAL, data BLOB, "
+                        "PRIMARY KEY (workshop_id, name, crc, width))")
+        self.used = {}
+
+def open_thumb_cache() -> ThumbCache | None:
+    if sqlite3 is None:
+        return None
+
+    try:
+        return ThumbCache(THUMB_CACHE_PATH)
+    except sqlite3.Error as e:
+        log_print(f"WARNING: Couldn't open thumbnail cache {THUMB_CACHE_PATH}: {e}")
+
+    return None
+
+def print_maps(gma : GMAFile, thumb_width : int, thumb_cache : ThumbCache | None):
     if len(gma.maps) > 0:
+        map_thumbs = None
         print(f"Maps:")
+        if thumb_width > 0:
+            gma.load_thumbs(thumb_width, thumb_cache)
         for i, gmap in enumerate(gma.maps.keys()):
             if thumb_width > 0:
                 if gma.maps[gmap] is not None:
                     if i > 0:
                         print()
-                    image = image_to_octants(gmap, gma.maps[gmap], thumb_width)
+                    image = gma.maps[gmap]
+                    if isinstance(image, bytes):
+                        image = image_to_octants(gmap, image, thumb_width)
+                        if image is not None and thumb_cache is not None:
+                            if map_thumbs is None:
+                                map_thumbs = {gmap: thumb for thumb, gmap in gma.get_thumb_maps().items()}
+                                crcs = gma.get_thumb_crcs()
+                            thumb = map_thumbs[gmap]
+                            # without a CRC there's no telling if it changed
+                            if crcs[thumb] != 0:
+                                thumb_cache.put(gma.workshop_id, thumb, crcs[thumb], thumb_width, image)
                     if image is not None:
                         print(image, end='')
             print(f" {gmap.stem}")
@@ -1021,10 +2107,135 @@ class RangeIterator:
         return self.num
 
 
+class GMAIndex:
+    # remembers what was in each GMA's header keyed on its path, size and
+    # modified time, so listing only has to open the ones that changed.  The
+    # file table is kept packed in its own column.
+
+    INDEX_VERSION = 2
+
+    def get(self, path : pathlib.PurePath, stat : os.stat_result) -> tuple[dict, bytes] | None:
+        row = self.rows.get(str(path))
+        if row is None or row[0] != stat.st_size or row[1] != stat.st_mtime:
+            return None
+
+        try:
+            return json.loads(row[2]), row[3]
+        except json.decoder.JSONDecodeError:
+            return None
+
+    def put(self, path : pathlib.PurePath, stat : os.stat_result, gma : GMAFile):
+        self.seen.add(str(path))
+        self.db.execute("INSERT OR REPLACE INTO gmas VALUES (?, ?, ?, ?, ?)",
+                        (str(path), stat.st_size, stat.st_mtime, json.dumps(gma.get_info()), gma.files.get_packed()))
+
+    def keep(self, path : pathlib.PurePath):
+        self.seen.add(str(path))
+
+    def close(self, prune : bool):
+        if prune:
+            # forget anything that's gone
+            for path in self.rows.keys():
+                if path not in self.seen:
+                    self.db.execute("DELETE FROM gmas WHERE path = ?", (path,))
+        self.db.commit()
+        self.db.close()
+
+    def __init__(self, path : str):
+        self.db = sqlite3.connect(path)
+        version, = self.db.execute("PRAGMA user_version").fetchone()
+        if version != self.INDEX_VERSION:
+            self.db.execute("DROP TABLE IF EXISTS gmas")
+            self.db.execute("CREATE TABLE gmas (path TEXT PRIMARY KEY, size INTEGER, mtime REAL, info TEXT, files BLOB)")
+            self.db.execute(f"PRAGMA user_version = {self.INDEX_VERSION}")
+
+        # just get it all at once, it's going to be needed anyway
+        self.rows = {row[0]: row[1:] for row in self.db.execute("SELECT path, size, mtime, info, files FROM gmas")}
+        self.seen = set()
+
+def load_gma(path : pathlib.PurePath, index : GMAIndex | None, keep_open : bool) -> tuple[GMAFile, os.stat_result | None, bool]:
+    # runs in a worker thread, so only reads from the index, returns whether
+    # it came from the index so the main thread can update it
+    compressed = False
+    if path.name.endswith("_legacy.bin"):
+        compressed = True
+
+    stat = None
+    if index is not None:
+        stat = os.stat(path)
+        indexed = index.get(path, stat)
+        if indexed is not None:
+            try:
+                return GMAFile.from_info(path, compressed, stat, *indexed), stat, True
+            except ValueError:
+                # something's wrong with it, just read the file again
+                pass
+
+    # if the data's going to be read right after, don't make legacy addons
+    # decompress the header twice
+    gma = GMAFile(path, compressed, keep_open=compressed and keep_open)
+
+    return gma, stat, False
+
+def load_gmas(paths : list[pathlib.PurePath], index : GMAIndex | None, keep_open : bool):
+    # read headers in parallel but hand them back in order, only letting a
+    # few get ahead so there aren't loads of legacy addons held open at once
+    with concurrent.futures.ThreadPoolExecutor(LIST_WORKERS) as executor:
+        pending = collections.deque()
+        paths = iter(paths)
+
+        while True:
+            for path in paths:
+                pending.append((path, executor.submit(load_gma, path, index, keep_open)))
+                if len(pending) >= LIST_WORKERS * 2:
+                    break
+
+            if len(pending) == 0:
+                break
+
+            path, future = pending.popleft()
+            gma, stat, indexed = future.result()
+
+            if index is not None:
+                if indexed:
+                    index.keep(path)
+                else:
+                    index.put(path, stat, gma)
+
+            yield gma
+
+class GMAJSONWriter:
+    # writes out each addon as it comes instead of building up one big list,
+    # either as one JSON array or as one object per line
+
+    def write(self, gma : GMAFile):
+        data = json.dumps(gma.get_dict())
+        if self.ndjson:
+            sys.stdout.write(data)
+            sys.stdout.write('\n')
+        else:
+            # same as what json.dumps() would do with the whole list
+            sys.stdout.write(', ' if self.count > 0 else '[')
+            sys.stdout.write(data)
+        self.count += 1
+
+    def close(self):
+        if not self.ndjson:
+            if self.count == 0:
+                sys.stdout.write('[')
+            sys.stdout.write(']\n')
+        sys.stdout.flush()
+
+    def __init__(self, ndjson : bool):
+        self.ndjson = ndjson
+        self.count = 0
+
 def get_gma_infos(path : pathlib.Path,
                   do_list : bool,
                   do_dump : bool,
+                  do_sync : bool,
                   do_json : bool,
+                  ndjson : bool,
                   thumb_width : int,
                   do_only : list[int],
                   sort_list : list[tuple[str, Callable[GMAFile]]],
@@ -1035,37 +2246,57 @@ def get_gma_infos(path : pathlib.Path,
     gma_paths = _get_gma_infos(path, do_only)
     gmas = []
 
-    for path in gma_paths:
-        compressed = False
-        if path[1].name.endswith("_legacy.bin"):
-            compressed = True
+    index = None
+    if sqlite3 is not None:
+        try:
+            index = GMAIndex(GMA_INDEX_PATH)
+        except sqlite3.Error as e:
+            log_print(f"WARNING: Couldn't open GMA index {GMA_INDEX_PATH}: {e}")
 
-        gma = GMAFile(path[1], compressed)
+    thumb_cache = None
+    if do_thumbs:
+        thumb_cache = open_thumb_cache()
 
-        if do_dump or do_thumbs:
-            maps = None
-            thumbs = None
-            # TODO: move thumbnail extraction until the end so only the needed ones get extracted
-            if do_thumbs:
-                maps = gma.maps
-                thumbs = gma.thumbs
-            dumpstate = DumpGMAFileState(path[1], do_dump, maps, thumbs)
+    json_writer = None
+    if do_json:
+        json_writer = GMAJSONWriter(ndjson)
 
+    # if it's not sorted, addons can just be written as they come and don't
+    # need to be kept around
+    stream_json = do_json and len(sort_list) == 0
+
+    with concurrent.futures.ThreadPoolExecutor(DUMP_WORKERS) as executor:
+        dumps = collections.deque()
+
+        for gma in load_gmas([path[1] for path in gma_paths], index, do_dump):
             if do_dump:
-                gma.read_all_data(dumpstate)
+                dumps.append(executor.submit(dump_gma, gma, do_thumbs, do_sync))
+                # don't let too many get ahead, legacy addons are held open
+                # until they're dumped
+                while len(dumps) > DUMP_WORKERS * 2:
+                    dumps.popleft().result()
             else:
-                gma.read_file_set(thumbs, dumpstate)
+                gma.close()
 
-        gma.close()
+            if stream_json:
+                json_writer.write(gma)
+            else:
+                gmas.append(gma)
+
+        for future in dumps:
+            future.result()
 
-        gmas.append(gma)
+    if index is not None:
+        # only forget missing addons if everything was looked at
+        index.close(len(do_only) == 0)
 
     for sort in sort_list:
         gmas = sorted(gmas, key=sort[1])
 
     if do_json:
-        gmadicts = [gma.get_dict() for gma in gmas]
-        print(json.dumps(gmadicts))
+        for gma in gmas:
+            json_writer.write(gma)
+        json_writer.close()
     else:
         r = RangeIterator(':', len(gmas))
         try:
@@ -1077,12 +2308,15 @@ def get_gma_infos(path : pathlib.Path,
             print(i, end=' ')
             if do_list:
                 print(f"{gma.workshop_id} {gma.name} {human_readable_size(gma.size)}")
-                print_maps(gma, thumb_width)
+                print_maps(gma, thumb_width, thumb_cache)
             else:
                 print(gma)
-                print_maps(gma, thumb_width)
+                print_maps(gma, thumb_width, thumb_cache)
             print()
 
+    if thumb_cache is not None:
+        thumb_cache.close()
+
 class SteamDepot:
     def __init__(self,
                  depot_name : str,
@@ -1110,7 +2344,12 @@ class SteamDepot:
         return self.files
 
 def get_mounted_depots(steampath : pathlib.PurePath):
-    depotspath = pathlib.PurePath(steampath, GARRYSMOD_PATH, DEPOTS_PATH)
+    libraries = get_library_paths(steampath)
+    gmodlibrary = find_app_library(libraries, GARRYSMOD_GAMEID)
+    if gmodlibrary is None:
+        gmodlibrary = steampath
+
+    depotspath = pathlib.PurePath(gmodlibrary, GARRYSMOD_PATH, DEPOTS_PATH)
 
     depotdata = parse_acf_file(depotspath)
 
@@ -1118,53 +2357,67 @@ def get_mounted_depots(steampath : pathlib.PurePath):
     depots = [SteamDepot("garrysmod",
                          GARRYSMOD_GAMEID,
                          "Garry's Mod",
-                         pathlib.PurePath(steampath, GARRYSMOD_PATH, "garrysmod"),
+                         pathlib.PurePath(gmodlibrary, GARRYSMOD_PATH, "garrysmod"),
                          None)]
 
     depotdict = depotdata["gamedepotsystem"]
     for depot in depotdict.keys():
         if int(depotdict[depot]) != 0:
             depotinfo = STEAM_DEPOTS[depot]
-            acfpath = pathlib.Path(steampath, "steamapps", f"appmanifest_{depotinfo[0]}.acf")
-            try:
-                depotdata = parse_acf_file(acfpath)
-            except FileNotFoundError:
+            library = find_app_library(libraries, depotinfo[0])
+            if library is None:
                 log_print(f"WARNING: Could not load app manifest for {depotinfo[0]} ({depotinfo[1]})!")
                 continue
+            acfpath = pathlib.Path(library, "steamapps", f"appmanifest_{depotinfo[0]}.acf")
+            depotdata = parse_acf_file(acfpath)
             depots.append(SteamDepot(depot,
                                      depotinfo[0],
                                      depotinfo[1],
-                                     pathlib.PurePath(steampath, STEAM_APP_PATH, depotdata["AppState"]["installdir"], depot),
+                                     pathlib.PurePath(library, STEAM_APP_PATH, depotdata["AppState"]["installdir"], depot),
                                      None))
 
     return depots
 
-def gather_files(path : pathlib.PurePath):
-    filelist = {}
-
-    for dirname in UNPACKED_FILE_DIRS:
-        for root, dirs, files in pathlib.Path(path, dirname).walk():
-            for file in files:
-                # get the relative path and join its directory parts back together
-                # in the same way as other gmod paths are
-                name = '/'.join(pathlib.PurePath(root, file).relative_to(path).parts)
-                hashobj = hashlib.sha1(usedforsecurity=False)
-                size = 0
-                with pathlib.Path(root, file).open('rb') as infile:
-                    while True:
-                        data = infile.read(READ_SIZE)
-                        if len(data) == 0:
-                            break
-                        size += len(data)
-                        hashobj.update(data)
-                filelist[name] = FileHash(size, hashobj.digest())
-
-    return filelist
+def gather_files(paths : list[pathlib.PurePath]) -> list[dict[str, int]]:
+    # walk all of them at once, a directory at a time in a pool since it's all
+    # waiting on the disk, and the disks might be different
+    filelists = [{} for _ in paths]
+
+    with concurrent.futures.ThreadPoolExecutor(LIST_WORKERS) as executor:
+        pending = {}
+        for num, path in enumerate(paths):
+            for dirname in UNPACKED_FILE_DIRS:
+                pending[executor.submit(scan_dir, os.path.join(path, dirname))] = (num, dirname)
+
+        while len(pending) > 0:
+            done, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                num, dirname = pending.pop(future)
+                files, dirs = future.result()
+                # names are joined with / like other gmod paths are
+                for name, size in files:
+                    filelists[num][f"{dirname}/{name}"] = size
+                for name in dirs:
+                    subdir = f"{dirname}/{name}"
+                    pending[executor.submit(scan_dir, os.path.join(paths[num], subdir))] = (num, subdir)
+
+    return filelists
+
+def read_naked_files(path : pathlib.PurePath, names : list[str], state : HashFileState):
+    for name in names:
+        state.new_file_cb(name)
+        with pathlib.Path(path, name).open('rb') as infile:
+            while True:
+                data = infile.read(READ_SIZE)
+                if len(data) == 0:
+                    break
+                state.data_cb(data)
+        state.end_file_cb()
 
 @dataclass
 class HashFileState():
     hashes : FileList_T
-    hashobj : SHA1_T | None
+    hashobj : object | None
     curname : str | None
     size : int
 
@@ -1174,26 +2427,63 @@ class HashFileState():
         self.curname = None
         self.size = 0
 
-def hash_new_file_cb(priv, name):
-    priv.hashobj = hashlib.sha1(usedforsecurity=False)
-    priv.curname = name
-    priv.size = 0
+    # same interface as DumpGMAFileState so GMAFile and VPKFile can both feed it
+
+    def new_file_cb(self, name):
+        self.hashobj = HASH_ALGORITHMS[hash_algorithm]()
+        self.curname = name
+        self.size = 0
+
+        return True
+
+    def data_cb(self, data):
+        self.size += len(data)
+        self.hashobj.update(data)
+
+        return True
+
+    def end_file_cb(self):
+        self.hashes[self.curname] = FileHash(self.size, self.hashobj.digest())
+
+        return True
+
+class CRCFileState(HashFileState):
+    # for comparing against the CRCs already stored in GMA and VPK files
+
+    def new_file_cb(self, name):
+        self.hashobj = 0
+        self.curname = name
+        self.size = 0
+
+        return True
 
-    return True
+    def data_cb(self, data):
+        self.size += len(data)
+        self.hashobj = zlib.crc32(data, self.hashobj)
 
-def hash_data_cb(priv, data):
-    priv.size += len(data)
-    priv.hashobj.update(data)
+        return True
 
-    return True
+    def end_file_cb(self):
+        self.hashes[self.curname] = FileHash(self.size, crc_digest(self.hashobj))
 
-def hash_end_file_cb(priv):
-    priv.hashes[priv.curname] = FileHash(priv.size, priv.hashobj.digest())
+        return True
 
-    return True
+def crc_digest(crc : int) -> bytes:
+    return crc.to_bytes(4, 'little')
 
 def get_cache_path(steampath : pathlib.PurePath, depot : SteamDepot):
-    path = depot.path.relative_to(pathlib.Path(steampath, STEAM_APP_PATH))
+    if isinstance(depot.source, GMAFile):
+        # addons aren't under the steam apps path, but they have a unique ID
+        return depot.path, f"{depot.depot_name}.vpkhashcache"
+
+    # named for where it is in whichever library it's in
+    path = depot.path
+    for library in get_library_paths(steampath):
+        try:
+            path = depot.path.relative_to(pathlib.Path(library, STEAM_APP_PATH))
+            break
+        except ValueError:
+            pass
     outname = str('_'.join(path.parts))
     if outname.endswith(VPKFile.DIRECTORY_SUFFIX):
         outname = outname[:-len(VPKFile.DIRECTORY_SUFFIX)]
@@ -1201,51 +2491,143 @@ def get_cache_path(steampath : pathlib.PurePath, depot : SteamDepot):
 
     return path, outname
 
-def write_cache(steampath : pathlib.PurePath, depot : SteamDepot, time : float):
+class HashCacheFile:
+    # a depot's hashes saved from an earlier scan.  They all get compared, so
+    # they're read in one go with get_files() and the file closed right after,
+    # with a cache per addon there can be thousands of them.
+    #
+    # header, then count records, then the string table with all the names
+    # header: magic, version, hash algorithm, key time, key size, key stamp, count, digest size, string table size
+    # record: offset in string table, name length, file size, digest
+
+    CACHE_MAGIC = b'GMHC'
+    CACHE_VERSION = 3
+
+    CACHE_HDR = struct.Struct("<4sI8sdQQIII")
+    CACHE_RECORD = struct.Struct("<IIQ")
+    CACHE_NAME = struct.Struct("<II") # just the start of a record, the rest is a packed FileHash
+
+    def encode_name(name : str) -> bytes:
+        # names from the filesystem might not be valid unicode
+        return name.encode('utf-8', 'surrogateescape')
+
+    def write(outname : str, files : FileList_T, key : CacheKey_T, algorithm : str):
+        names = [(HashCacheFile.encode_name(name), name) for name in files.keys()]
+        digest_size = 0
+        if len(names) > 0:
+            digest_size = len(files[names[0][1]]) - FileHash.SIZE.size
+
+        header = HashCacheFile.CACHE_HDR.pack(HashCacheFile.CACHE_MAGIC,
+                                              HashCacheFile.CACHE_VERSION,
+                                              algorithm.encode('ascii'),
+                                              *key,
+                                              len(names),
+                                              digest_size,
+                                              sum(len(name[0]) for name in names))
+        records = bytearray()
+        strtab = bytearray()
+        for encoded, name in names:
+            records += HashCacheFile.CACHE_NAME.pack(len(strtab), len(encoded))
+            records += files[name]
+            strtab += encoded
+
+        # write to the side and move it in to place so nothing ever sees half a
+        # cache file
+        tmpname = f"{outname}.tmp"
+        with open(tmpname, 'wb') as cachefile:
+            cachefile.write(header)
+            cachefile.write(records)
+            cachefile.write(strtab)
+        os.replace(tmpname, outname)
+
+    def get_files(self) -> FileList_T:
+        record = struct.Struct(f"<II{FileHash.SIZE.size + self.digest_size}s")
+        records = self.map[self.CACHE_HDR.size:self.strpos]
+        strtab = self.map[self.strpos:self.strpos+self.strtab_size]
+        files = {}
+        for offset, length, packed in record.iter_unpack(records):
+            files[strtab[offset:offset+length].decode('utf-8', 'surrogateescape')] = FileHash.from_packed(packed)
+
+        return files
+
+    def close(self):
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_tb):
+        self.close()
+        return False
+
+    def __init__(self, path : str):
+        with open(path, 'rb') as cachefile:
+            self.map = mmap.mmap(cachefile.fileno(), 0, access=mmap.ACCESS_READ)
+
+        try:
+            self.read_header()
+        except ValueError:
+            self.close()
+            raise
+
+    def read_header(self):
+        if len(self.map) < self.CACHE_HDR.size:
+            raise ValueError("Truncated hash cache file.")
+        magic, version, algorithm, keytime, keysize, keystamp, self.count, self.digest_size, self.strtab_size = self.CACHE_HDR.unpack_from(self.map, 0)
+        if magic != self.CACHE_MAGIC or version != self.CACHE_VERSION:
+            raise ValueError("Not a hash cache file or an unsupported version.")
+        self.algorithm = algorithm.rstrip(b'\0').decode('ascii', 'replace')
+        self.key = (keytime, keysize, keystamp)
+
+        self.record_size = self.CACHE_RECORD.size + self.digest_size
+        self.strpos = self.CACHE_HDR.size + (self.count * self.record_size)
+        if self.strpos + self.strtab_size > len(self.map):
+            raise ValueError("Truncated hash cache file.")
+
+def write_cache(steampath : pathlib.PurePath, depot : SteamDepot, key : CacheKey_T):
     path, outname = get_cache_path(steampath, depot)
 
     #print(f"Writing cache for {path} to {outname}.")
-    with open(outname, 'w') as cachefile:
-        cachefile.write(f"{time}\n")
-        for file in depot.files.keys():
-            hexstr = ""
-            for b in depot.files[file].digest:
-                hexstr += f"{b:02X}"
-            cachefile.write(f"{depot.files[file].size} {hexstr} {file}\n")
-
-def read_cache(steampath : pathlib.PurePath, depot : SteamDepot, time : float):
-    filelist : FileList_T = {}
+    HashCacheFile.write(outname, depot.files, key, hash_algorithm)
 
+def read_cache(steampath : pathlib.PurePath, depot : SteamDepot, key : CacheKey_T):
     path, outname = get_cache_path(steampath, depot)
 
     try:
-        with open(outname, 'r') as cachefile:
-            #print(f"Reading cache for {path} from {outname}.")
-            cachetime = float(cachefile.readline())
-            if cachetime < time:
-                # if cache is older than the file time, the cache is invalid
-                return None
-            for line in cachefile.readlines():
-                size, digest, name = line.split(maxsplit=2)
-                digestarray = array.array('B', itertools.repeat(0, len(digest) // 2))
-                for i in range(len(digestarray)):
-                    digestarray[i] = int(digest[i*2:(i*2)+1], base=16)
-                # remove the newline
-                filelist[name[:-1]] = FileHash(size, digestarray.tobytes())
+        #print(f"Reading cache for {path} from {outname}.")
+        filelist = HashCacheFile(outname)
     except FileNotFoundError:
         return None
+    except ValueError:
+        # old, corrupt or empty, just make a new one
+        return None
+
+    with filelist:
+        if filelist.key != key:
+            # whatever was cached has changed since
+            return None
+
+        if filelist.algorithm != hash_algorithm:
+            # hashes from something else can't be compared
+            return None
 
-    return filelist
+        return filelist.get_files()
 
 def list_depot(steampath : pathlib.PurePath, depot : SteamDepot):
     newdepots = [depot]
 
     for item in pathlib.Path(depot.path).glob(f"*{VPKFile.DIRECTORY_SUFFIX}", case_sensitive=False):
+        vpk = VPKFile(pathlib.PurePath(depot.path, item))
+        if vpk.files is None:
+            log_print(f"WARNING: {item} doesn't look like a VPK directory, skipping.")
+            continue
         newdepots.append(SteamDepot(depot.depot_name,
                                     depot.game_id,
                                     depot.game_name,
                                     item,
-                                    VPKFile(pathlib.PurePath(depot.path, item))))
+                                    vpk))
 
     return newdepots
 
@@ -1257,64 +2639,312 @@ def get_depots(steampath : pathlib.PurePath):
 
     return newdepots
 
-def hash_naked_files(steampath : pathlib.PurePath, depot : SteamDepot):
-    stat = os.stat(depot.path)
-    naked_files = read_cache(steampath, depot, stat.st_ctime)
-    if naked_files is None:
-        naked_files = gather_files(depot.path)
-        depot.set_files(naked_files)
-        write_cache(steampath, depot, stat.st_ctime)
-        return False
-    else:
-        depot.set_files(naked_files)
-    return True
-
-def hash_gma_files(depot : SteamDepot):
-    priv = HashFileState()
-    depot.source.read_all_data(hash_new_file_cb, hash_data_cb, hash_end_file_cb, priv)
-    depot.set_files(priv.hashes)
-    depot.source.close()
-    # never cached
-    return False
-
-def hash_vpk_files(steampath : pathlib.PurePath, depot : SteamDepot):
-    depot_files = read_cache(steampath, depot, depot.source.filetime)
-    if depot_files is None:
-        priv = HashFileState()
-        depot.source.read_all_data(hash_new_file_cb, hash_data_cb, hash_end_file_cb, priv)
-        depot.source.close()
-        depot.set_files(priv.hashes)
-        write_cache(steampath, depot, depot.source.filetime)
-        return False
-    else:
-        depot.set_files(depot_files)
-        depot.source.close()
-    return True
+def get_cache_key(depot : SteamDepot) -> CacheKey_T:
+    if depot.source is None:
+        return (os.stat(depot.path).st_ctime, 0, 0)
+    elif isinstance(depot.source, VPKFile):
+        return (depot.source.filetime, depot.source.size, 0)
+    elif isinstance(depot.source, GMAFile):
+        # the workshop ID is already in the cache name
+        return (depot.source.mtime, depot.source.size, depot.source.timestamp)
+    raise RuntimeError("Couldn't determine depot source (this is a bug!)")
 
-def hash_depot(sem : threading.Semaphore, steampath : pathlib.PurePath, depot : SteamDepot):
-    cached = False
+def get_depot_sizes(depot : SteamDepot) -> dict[str, int]:
     if depot.source is None:
-        cached = hash_naked_files(steampath, depot)
+        return gather_files([depot.path])[0]
     elif isinstance(depot.source, VPKFile):
-        cached = hash_vpk_files(steampath, depot)
+        files = depot.source.files
+        return {name: preload + size for name, preload, size in zip(files.names(),
+                                                                    files.column('preload_bytes'),
+                                                                    files.column('archive_bytes'))}
     elif isinstance(depot.source, GMAFile):
-        cached = hash_gma_files(depot)
-    else:
-        raise RuntimeError("Couldn't determine depot source (this is a bug!)")
-    log_print(f"Hashed {depot.path}", end='')
-    if cached:
-        log_print(" (cached)")
+        return dict(zip(depot.source.files.names(), depot.source.files.column('size')))
+    raise RuntimeError("Couldn't determine depot source (this is a bug!)")
+
+def get_all_depot_sizes(depots : list[SteamDepot]) -> list[dict[str, int]]:
+    # loose files for all the depots are gathered together so it can all happen at once
+    naked = [num for num, depot in enumerate(depots) if depot.source is None]
+    all_sizes = [None if depot.source is None else get_depot_sizes(depot) for depot in depots]
+    for num, sizes in zip(naked, gather_files([depots[num].path for num in naked])):
+        all_sizes[num] = sizes
+
+    return all_sizes
+
+def get_depot_crcs(depot : SteamDepot) -> dict[str, int]:
+    if isinstance(depot.source, (VPKFile, GMAFile)):
+        return dict(zip(depot.source.files.names(), depot.source.files.column('crc')))
+    # loose files don't come with any
+    return {}
+
+def get_shared_sizes(depots : list[SteamDepot]) -> dict[int, dict[str, int]]:
+    # only files which are in an addon and somewhere else can collide.  Those
+    # get filled in with their size and stored CRC and anything without a CRC
+    # is returned to be read.
+    all_sizes = get_all_depot_sizes(depots)
+
+    counts = {}
+    addon_names = set()
+    for depot, sizes in zip(depots, all_sizes):
+        for name in sizes.keys():
+            counts[name] = counts.get(name, 0) + 1
+        if isinstance(depot.source, GMAFile):
+            addon_names.update(sizes.keys())
+    shared = {name for name in addon_names if counts[name] > 1}
+
+    depot_sizes = {}
+    for num, depot in enumerate(depots):
+        files = {}
+        to_read = {}
+        crcs = get_depot_crcs(depot)
+        for name, size in all_sizes[num].items():
+            if name not in shared:
+                continue
+            crc = crcs.get(name)
+            if crc is None or (crc == 0 and size > 0):
+                # missing or just never filled in
+                to_read[name] = size
+            else:
+                files[name] = FileHash(size, crc_digest(crc))
+        depot.set_files(files)
+        if len(to_read) > 0:
+            depot_sizes[num] = to_read
+
+    return depot_sizes
+
+@dataclass
+class HashTask():
+    depot : int # index in to the list of depots
+    size : int
+    names : list[str]
+
+def make_hash_tasks(num : int, sizes : dict[str, int], split_size : int) -> list[HashTask]:
+    tasks = [HashTask(num, 0, [])]
+
+    for name in sizes.keys():
+        if tasks[-1].size >= split_size:
+            tasks.append(HashTask(num, 0, []))
+        tasks[-1].names.append(name)
+        tasks[-1].size += sizes[name]
+
+    return tasks
+
+# sources to hash from, indexed the same as the depots list.  Sent to each
+# worker once on startup rather than with every task.
+hash_sources : list[ValveFile | pathlib.PurePath] = []
+
+def init_hash_worker(encoding : str, algorithm : str, sources : list[ValveFile | pathlib.PurePath]):
+    # worker processes may not have inherited the command line options
+    global fallback_encoding, hash_algorithm, hash_sources
+    fallback_encoding = encoding
+    hash_algorithm = algorithm
+    hash_sources = sources
+
+def hash_files(num : int, names : list[str], fast : bool) -> tuple[FileList_T, float]:
+    # this may run in another process, so the results have to be handed back
+    # instead of just left in the depot.  Also hands back how long it took.
+    start = time.monotonic()
+    state = CRCFileState() if fast else HashFileState()
+    source = hash_sources[num]
+
+    if isinstance(source, ValveFile):
+        # other tasks may be reading from the same file at the same time
+        source = source.clone()
+        source.read_files(names, state)
+        source.close()
     else:
-        log_print()
-    sem.release()
+        read_naked_files(source, names, state)
 
-def depot_sort_key(depot : SteamDepot):
-    if depot.source is None:
-        return 1<<31 # put bare directories further up
+    return state.hashes, time.monotonic() - start
 
-    return depot.source.size
+@dataclass
+class DepotStats():
+    path : str
+    cached : bool
+    files : int
+    # only what was hashed this time, cached depots have 0
+    hashed_size : int
+    tasks : int
+    # time spent in workers hashing it, adds up across workers
+    hash_time : float
+    # from when hashing started until its last task was done
+    finished : float
+
+class ScanStats:
+    # progress and throughput of a collisions scan, for printing as it goes
+    # and writing out with --stats-json at the end
+
+    def start_phase(self, name : str):
+        now = time.monotonic()
+        if self.phase is not None:
+            self.phases[self.phase] = now - self.phase_start
+        self.phase = name
+        self.phase_start = now
+
+    def add_cached(self, depot : SteamDepot):
+        self.depots[str(depot.path)] = DepotStats(str(depot.path), True, len(depot.get_files()), 0, 0, 0.0, 0.0)
+        self.cache_hits += 1
+
+    def add_uncached(self):
+        self.cache_misses += 1
+
+    def add_hashing(self, depot : SteamDepot, sizes : dict[str, int], tasks : int):
+        size = sum(sizes.values())
+        self.depots[str(depot.path)] = DepotStats(str(depot.path), False, len(sizes), size, tasks, 0.0, 0.0)
+        self.total_files += len(sizes)
+        self.total_size += size
+
+    def start_hashing(self):
+        self.start_phase("hashing")
+        self.hash_start = self.last_progress = time.monotonic()
+
+    def task_done(self, depot : SteamDepot, task : HashTask, hash_time : float):
+        self.hashed_files += len(task.names)
+        self.hashed_size += task.size
+        stats = self.depots[str(depot.path)]
+        stats.hash_time += hash_time
+        stats.finished = time.monotonic() - self.hash_start
+
+        now = time.monotonic()
+        if now - self.last_progress >= PROGRESS_INTERVAL:
+            self.last_progress = now
+            log_print(self.get_progress())
+
+    def get_rates(self) -> tuple[float, float]:
+        # once it's done, don't count the time after
+        elapsed = max(self.phases.get("hashing", time.monotonic() - self.hash_start), 0.001)
+        return self.hashed_size / elapsed, self.hashed_files / elapsed
+
+    def get_progress(self) -> str:
+        size_rate, file_rate = self.get_rates()
+        percent = 100 if self.total_size == 0 else self.hashed_size * 100 // self.total_size
+        eta = ""
+        if size_rate > 0:
+            eta = f"  ETA: {math.ceil((self.total_size - self.hashed_size) / size_rate)}s"
+        return f"{percent}%  {human_readable_size(self.hashed_size)}/{human_readable_size(self.total_size)}  " \
+               f"{human_readable_size(int(size_rate))}/s  {file_rate:.0f} files/s{eta}"
+
+    def get_depot_done(self, depot : SteamDepot) -> str:
+        stats = self.depots[str(depot.path)]
+        return f"{stats.files} files, {human_readable_size(stats.hashed_size)} in {stats.hash_time:.1f}s"
+
+    def get_summary(self) -> str:
+        size_rate, file_rate = self.get_rates()
+        looked_up = self.cache_hits + self.cache_misses
+        hit_rate = "" if looked_up == 0 else f", {self.cache_hits}/{looked_up} depots cached"
+        return f"Hashed {self.hashed_files} files, {human_readable_size(self.hashed_size)} in " \
+               f"{self.phases.get('hashing', 0.0):.1f}s ({human_readable_size(int(size_rate))}/s, " \
+               f"{file_rate:.0f} files/s){hit_rate}"
+
+    def finish(self):
+        self.start_phase(None)
+        self.elapsed = time.monotonic() - self.start
+
+    def get_dict(self) -> dict:
+        size_rate, file_rate = self.get_rates()
+        looked_up = self.cache_hits + self.cache_misses
+        return {'elapsed': self.elapsed,
+                'phases': self.phases,
+                'workers': self.workers,
+                'executor': self.executor,
+                'hash': self.algorithm,
+                'hashed_files': self.hashed_files,
+                'hashed_size': self.hashed_size,
+                'bytes_per_second': size_rate,
+                'files_per_second': file_rate,
+                'cache_hits': self.cache_hits,
+                'cache_misses': self.cache_misses,
+                'cache_hit_rate': None if looked_up == 0 else self.cache_hits / looked_up,
+                'collisions': self.collisions,
+                'depots': [vars(stats) for stats in self.depots.values()]}
+
+    def write(self, path : pathlib.PurePath):
+        with pathlib.Path(path).open('w') as outfile:
+            json.dump(self.get_dict(), outfile, indent=2)
+
+    def __init__(self, workers : int, executor : str, algorithm : str):
+        self.workers = workers
+        self.executor = executor
+        self.algorithm = algorithm
+        self.start = time.monotonic()
+        self.elapsed = 0.0
+        self.phase = None
+        self.phase_start = self.start
+        self.phases : dict[str, float] = {}
+        self.depots : dict[str, DepotStats] = {}
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.total_files = 0
+        self.total_size = 0
+        self.hashed_files = 0
+        self.hashed_size = 0
+        self.hash_start = self.start
+        self.last_progress = self.start
+        self.collisions = 0
+
+class CollisionIndex:
+    # file path -> the depots which have it and their hashes, so every file
+    # only gets looked at once instead of intersecting every pair of depots.
+    # Depots can be added or removed later and only the paths they have get
+    # looked at again.  Each path also counts how many depots have each
+    # distinct hash, so it collides when there's more than one of those.
+
+    def update_bucket(self, name : str):
+        if len(self.counts[name]) > 1:
+            self.colliding.add(name)
+        else:
+            self.colliding.discard(name)
+
+    def add_depot(self, depot : SteamDepot):
+        for name, filehash in depot.get_files().items():
+            bucket = self.buckets.get(name)
+            if bucket is None:
+                self.buckets[name] = {depot: filehash}
+                self.counts[name] = collections.Counter((filehash,))
+                continue
+            counts = self.counts[name]
+            old = bucket.get(depot)
+            if old is not None:
+                # added again, forget what it was before
+                counts[old] -= 1
+                if counts[old] == 0:
+                    del counts[old]
+            bucket[depot] = filehash
+            counts[filehash] += 1
+            self.update_bucket(name)
+
+    def remove_depot(self, depot : SteamDepot):
+        for name in depot.get_files().keys():
+            bucket = self.buckets.get(name)
+            if bucket is None:
+                continue
+            filehash = bucket.pop(depot, None)
+            if filehash is None:
+                continue
+            if len(bucket) == 0:
+                del self.buckets[name]
+                del self.counts[name]
+                self.colliding.discard(name)
+                continue
+            counts = self.counts[name]
+            counts[filehash] -= 1
+            if counts[filehash] == 0:
+                del counts[filehash]
+            self.update_bucket(name)
 
-def collisions_scan(steampath : pathlib.PurePath, do_only=[], num_threads=1):
+    def get_collisions(self) -> dict[str, set[SteamDepot]]:
+        # if there's more than one version of a file, every depot which has
+        # it differs from at least one other
+        return {name: set(self.buckets[name].keys()) for name in self.colliding}
+
+    def __init__(self):
+        self.buckets : dict[str, dict[SteamDepot, FileHash]] = {}
+        self.counts : dict[str, collections.Counter[FileHash]] = {}
+        self.colliding : set[str] = set()
+
+def collisions_scan(steampath : pathlib.PurePath, do_only=[], num_workers=1, executor="thread", fast=False, stats_path=None):
+    stats = ScanStats(num_workers, executor, "crc32" if fast else hash_algorithm)
+
+    stats.start_phase("gathering")
     log_print("Gathering mounted files...")
     depots = get_depots(steampath)
 
@@ -1333,38 +2963,86 @@ def collisions_scan(steampath : pathlib.PurePath, do_only=[], num_threads=1):
                                  path[1],
                                  gma))
 
-    # get the larger files first to minimize time at the end potentially
+    sources = [depot.path if depot.source is None else depot.source for depot in depots]
+    depot_sizes = {}
+    cachekeys = []
+    if fast:
+        # comparing by size and CRC, which the caches don't have
+        stats.start_phase("sharing")
+        log_print("Finding shared files...")
+        depot_sizes = get_shared_sizes(depots)
+    else:
+        stats.start_phase("caches")
+        log_print("Reading caches...")
+        uncached = []
+        for num, depot in enumerate(depots):
+            cachekey = get_cache_key(depot)
+            cachekeys.append(cachekey)
+            files = read_cache(steampath, depot, cachekey)
+            if files is not None:
+                depot.set_files(files)
+                stats.add_cached(depot)
+                log_print(f"Hashed {depot.path} (cached)")
+                continue
+            depot.set_files({})
+            stats.add_uncached()
+            uncached.append(num)
+        for num, sizes in zip(uncached, get_all_depot_sizes([depots[num] for num in uncached])):
+            depot_sizes[num] = sizes
+
+    # split everything up in to tasks small enough that a few big depots don't
+    # leave the other workers idle at the end, but not so small that the
+    # overhead of a task matters
+    total_size = sum(sum(sizes.values()) for sizes in depot_sizes.values())
+    split_size = max(MIN_TASK_SIZE, total_size // (num_workers * TASKS_PER_WORKER))
+    tasks = []
+    remaining = {}
+    for num, sizes in depot_sizes.items():
+        depot = depots[num]
+        if isinstance(depot.source, GMAFile) and depot.source.compressed:
+            # can't seek around in these so it has to go in one piece
+            depot_tasks = make_hash_tasks(num, sizes, total_size + 1)
+        elif isinstance(depot.source, VPKFile):
+            # keep each task to one stretch of an archive
+            sizes = {name: sizes[name] for name in depot.source.physical_order(sizes.keys())}
+            depot_tasks = make_hash_tasks(num, sizes, split_size)
+        else:
+            depot_tasks = make_hash_tasks(num, sizes, split_size)
+        remaining[num] = len(depot_tasks)
+        tasks.extend(depot_tasks)
+        stats.add_hashing(depot, sizes, len(depot_tasks))
+    # get the larger tasks first to minimize time at the end potentially
     # waiting on fewer large tasks
-    depots = sorted(depots, key=depot_sort_key, reverse=True)
-
-    log_print(f"Hashing files... ({num_threads} thread(s))")
-    sem = threading.Semaphore(num_threads)
-    threads = []
-    for depot in depots:
-        sem.acquire()
-        threads.append(threading.Thread(target=hash_depot, args=(sem, steampath, depot)))
-        threads[-1].start()
-    # wait for the rest to finish
-    for i in range(num_threads):
-        sem.acquire()
-
+    tasks = sorted(tasks, key=lambda x: x.size, reverse=True)
+
+    stats.start_hashing()
+    log_print(f"Hashing files... ({len(tasks)} task(s), {num_workers} {executor} worker(s))")
+    with EXECUTORS[executor](max_workers=num_workers,
+                             initializer=init_hash_worker,
+                             initargs=(fallback_encoding, hash_algorithm, sources)) as pool:
+        futures = {}
+        for task in tasks:
+            futures[pool.submit(hash_files, task.depot, task.names, fast)] = task
+        for future in concurrent.futures.as_completed(futures):
+            task = futures[future]
+            num = task.depot
+            depot = depots[num]
+            hashes, hash_time = future.result()
+            depot.get_files().update(hashes)
+            stats.task_done(depot, task, hash_time)
+            remaining[num] -= 1
+            if remaining[num] == 0:
+                if not fast:
+                    write_cache(steampath, depot, cachekeys[num])
+                log_print(f"Hashed {depot.path} ({stats.get_depot_done(depot)})")
+
+    stats.start_phase("collisions")
+    log_print(stats.get_summary())
     log_print("Finding collisions...")
-    depotsets = []
+    index = CollisionIndex()
     for depot in depots:
-        depotsets.append(set(depot.files.keys()))
-
-    collisions = {}
-    for num1, depot1 in enumerate(depotsets):
-        for num2, depot2 in enumerate(depotsets[num1+1:]):
-            intersection = depot1.intersection(depot2)
-            for item in intersection:
-                if depots[num1].files[item] != depots[num1+1+num2].files[item]:
-                    # if size and hash differs, add it
-                    if item in collisions:
-                        collisions[item].add(depots[num1])
-                        collisions[item].add(depots[num1+1+num2])
-                    else:
-                        collisions[item] = {depots[num1], depots[num1+1+num2]}
+        index.add_depot(depot)
+    collisions = index.get_collisions()
 
     for collision in collisions.keys():
         addon = False
@@ -1372,11 +3050,16 @@ def collisions_scan(steampath : pathlib.PurePath, do_only=[], num_threads=1):
             if isinstance(depot.source, GMAFile):
                 addon = True
         if addon:
+            stats.collisions += 1
             print(f"File: {collision}")
             for depot in collisions[collision]:
                 print(f" Source: {depot.game_name}  Path: {depot.path}")
             print()
 
+    stats.finish()
+    if stats_path is not None:
+        stats.write(stats_path)
+
 def make_sort_list(sort_list_string):
     sort_list = []
 
@@ -1389,8 +3072,10 @@ def make_sort_list(sort_list_string):
     return sort_list
 
 def usage(app):
-    print(f"USAGE: {app} [--list | --sort[=]<criteria[,criteria,...]> | --dump | --steampath[=]<path to steam> | <workshop ID>]...\n"
-          "           --collisions-scan [--steampath[=]<path to steam> | --threads[=]<number of threads>]... | --thumbs[[=]<width>]\n"
+    print(f"USAGE: {app} [--list | --sort[=]<criteria[,criteria,...]> | --dump | --sync | --json | --ndjson | --steampath[=]<path to steam> | <workshop ID>]...\n"
+          "           --collisions-scan [--steampath[=]<path to steam> | --workers[=]<number of workers> |\n"
+          "                              --executor[=]<thread|process> | --fast | --hash[=]<algorithm> |\n"
+          "                              --stats-json[=]<output file>]... | --thumbs[[=]<width>]\n"
           "           --ranges[=]<range[,range,...]")
     print("\nSort criterias:\n")
     for sort in GMAFile.SORTS.keys():
@@ -1402,12 +3087,17 @@ if __name__ == '__main__':
     do_collisions = False
     do_list = False
     do_dump = False
+    do_sync = False
     do_json = False
+    ndjson = False
     thumb_width = -1
     do_only = []
     sort_list = []
     path = pathlib.Path.home().joinpath(DEFAULT_STEAM_PATH)
-    threads = 1
+    workers = 1
+    executor = "thread"
+    fast = False
+    stats_path = None
     ranges = None
 
     # ultra simple args parsing
@@ -1423,25 +3113,59 @@ if __name__ == '__main__':
                 argv = argv[1:]
             elif arg == 'dump':
                 do_dump = True
+            elif arg == 'sync':
+                do_dump = True
+                do_sync = True
             elif arg == 'collisions-scan':
                 do_collisions = True
+            elif arg == 'fast':
+                fast = True
             elif arg == 'json':
                 do_json = True
+            elif arg == 'ndjson':
+                do_json = True
+                ndjson = True
             elif arg.startswith('steampath='):
                 path = pathlib.PurePath(arg[10:])
             elif len(argv) > 1 and arg == 'steampath':
                 path = pathlib.PurePath(argv[1])
                 argv = argv[1:]
-            elif arg.startswith('threads='):
-                threads = int(arg[8:])
-                if threads < 1:
-                    print("Threads must be greater than 0.")
+            elif arg.startswith('threads=') or arg.startswith('workers='):
+                workers = int(arg[8:])
+                if workers < 1:
+                    print("Workers must be greater than 0.")
+                    do_usage = True
+                    break
+            elif len(argv) > 1 and (arg == 'threads' or arg == 'workers'):
+                workers = int(argv[1])
+                if workers < 1:
+                    print("Workers must be greater than 0.")
+                    do_usage = True
+                    break
+                argv = argv[1:]
+            elif arg.startswith('hash='):
+                hash_algorithm = arg[5:]
+                if hash_algorithm not in HASH_ALGORITHMS:
+                    print(f"Hash must be one of: {', '.join(HASH_ALGORITHMS.keys())}")
                     do_usage = True
                     break
-            elif len(argv) > 1 and arg == 'threads':
-                threads = int(argv[1])
-                if threads < 1:
-                    print("Threads must be greater than 0.")
+            elif len(argv) > 1 and arg == 'hash':
+                hash_algorithm = argv[1]
+                if hash_algorithm not in HASH_ALGORITHMS:
+                    print(f"Hash must be one of: {', '.join(HASH_ALGORITHMS.keys())}")
+                    do_usage = True
+                    break
+                argv = argv[1:]
+            elif arg.startswith('executor='):
+                executor = arg[9:]
+                if executor not in EXECUTORS:
+                    print(f"Executor must be one of: {', '.join(EXECUTORS.keys())}")
+                    do_usage = True
+                    break
+            elif len(argv) > 1 and arg == 'executor':
+                executor = argv[1]
+                if executor not in EXECUTORS:
+                    print(f"Executor must be one of: {', '.join(EXECUTORS.keys())}")
                     do_usage = True
                     break
                 argv = argv[1:]
@@ -1473,6 +3197,11 @@ if __name__ == '__main__':
                     print("Thumbnails width must be greater than 0.")
                     do_usage = True
                     break
+            elif arg.startswith('stats-json='):
+                stats_path = pathlib.PurePath(arg[11:])
+            elif len(argv) > 1 and arg == 'stats-json':
+                stats_path = pathlib.PurePath(argv[1])
+                argv = argv[1:]
             elif arg == 'ranges':
                 ranges = argv[1]
                 argv = argv[1:]
@@ -1498,6 +3227,6 @@ if __name__ == '__main__':
     if do_usage:
         usage(sys.argv[0])
     elif do_collisions:
-        collisions_scan(path, do_only, threads)
+        collisions_scan(path, do_only, workers, executor, fast, stats_path)
     else:
-        get_gma_infos(path, do_list, do_dump, do_json, thumb_width, do_only, sort_list, ranges)
+        get_gma_infos(path, do_list, do_dump, do_sync, do_json, ndjson, thumb_width, do_only, sort_list, ranges)